@@ -0,0 +1,140 @@
+# Copyright 2013 (C) Daniel Richman. License: GNU GPL 3
+
+# Shared by debian.py and mingw.py: memoizes autoreconf/autoconf runs.
+# The key is a hash of the command, the autotools' versions and every
+# autotools input in the source tree (configure.ac/.in, *.am, *.m4). On a
+# miss the command is run and whatever files it created or changed are
+# archived; on a hit that archive is unpacked instead.
+#
+# Anything else configure.ac reads (m4_esyscmd, m4_include of a file with
+# another name, build-aux scripts) is not in the key, and a change to it
+# can give a stale hit. So the builders only use this when asked to.
+
+import os
+import os.path
+import json
+import time
+import errno
+import logging
+import hashlib
+import tarfile
+import tempfile
+import subprocess
+
+logger = logging.getLogger("builder")
+
+TOOLS = ["autoconf", "autoheader", "automake", "aclocal", "libtoolize"]
+INPUT_NAMES = ["configure.ac", "configure.in"]
+INPUT_EXTENSIONS = [".am", ".m4"]
+SKIP_DIRS = [".git", "autom4te.cache"]
+KEEP = 20
+
+class AutotoolsCache:
+    def __init__(self, directory):
+        self.directory = directory
+        self.versions = None
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.isdir(directory):
+            os.mkdir(directory)
+
+    def run(self, srcdir, args, run_command):
+        """Run args in srcdir using run_command(*args, cwd=srcdir)."""
+
+        key = self.key(srcdir, args)
+        fn = os.path.join(self.directory, key + ".tar.gz")
+
+        if os.path.exists(fn):
+            logger.debug("Restoring " + args[0] + " outputs " + key)
+            self.restore(fn, srcdir)
+            self.hits += 1
+            return
+
+        before = self.snapshot(srcdir)
+        run_command(*args, cwd=srcdir)
+        after = self.snapshot(srcdir)
+
+        outputs = sorted(p for p in after if before.get(p) != after[p])
+        self.store(fn, srcdir, outputs)
+        self.misses += 1
+
+    def key(self, srcdir, args):
+        if self.versions is None:
+            self.versions = [self.tool_version(t) for t in TOOLS]
+
+        h = hashlib.sha1(json.dumps([list(args), self.versions]))
+        for path in sorted(self.walk(srcdir)):
+            name = os.path.basename(path)
+            if name in INPUT_NAMES or \
+                    os.path.splitext(name)[1] in INPUT_EXTENSIONS:
+                with open(os.path.join(srcdir, path), "rb") as f:
+                    h.update(path + "\0" + hashlib.sha1(f.read()).digest())
+        return h.hexdigest()
+
+    def tool_version(self, tool):
+        try:
+            p = subprocess.Popen((tool, "--version"), stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT)
+        except OSError:
+            return tool + " missing"
+        return p.communicate()[0].split("\n")[0]
+
+    def walk(self, srcdir):
+        for (path, dirnames, filenames) in os.walk(srcdir):
+            dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+            for fn in filenames:
+                yield os.path.relpath(os.path.join(path, fn), srcdir)
+
+    def snapshot(self, srcdir):
+        files = {}
+        for path in self.walk(srcdir):
+            s = os.lstat(os.path.join(srcdir, path))
+            files[path] = (s.st_size, s.st_mtime, s.st_mode)
+        return files
+
+    def store(self, fn, srcdir, outputs):
+        # Write and rename, so that concurrent builders never see a
+        # partial archive.
+        (fd, tmp) = tempfile.mkstemp(dir=self.directory, prefix=".store-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                with tarfile.open(fileobj=f, mode="w:gz") as t:
+                    for path in outputs:
+                        t.add(os.path.join(srcdir, path), path,
+                              recursive=False)
+            os.rename(tmp, fn)
+        except:
+            os.unlink(tmp)
+            raise
+
+        self.prune()
+
+    def restore(self, fn, srcdir):
+        with tarfile.open(fn) as t:
+            members = t.getmembers()
+            t.extractall(srcdir)
+
+        # Give every output the same, current, mtime: newer than the
+        # freshly checked out inputs, but not newer than each other, so
+        # that make's rebuild rules for configure etc. don't fire.
+        now = time.time()
+        for m in members:
+            if not m.issym():
+                os.utime(os.path.join(srcdir, m.name), (now, now))
+
+        os.utime(fn, None)
+
+    def prune(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".tar.gz"):
+                path = os.path.join(self.directory, name)
+                entries.append((os.stat(path).st_mtime, path))
+
+        for (mtime, path) in sorted(entries, reverse=True)[KEEP:]:
+            try:
+                os.unlink(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
@@ -0,0 +1,576 @@
+#!/usr/bin/python
+# Copyright 2013 (C) Daniel Richman. License: GNU GPL 3
+
+# Measures the cost of the build orchestration itself, by running
+# mingw.py's and debian.py's Builders against stand-ins: stub compilers,
+# make, configure, debuild and makensis that only sleep, burn CPU and print,
+# synthetic tarballs served from a local HTTP server, and a local git repo
+# playing dl-fldigi. Nothing outside localhost is touched.
+#
+# Scenarios:
+#   mingw-cold          empty tarball cache and build directory
+#   mingw-warm          tarballs cached, fresh build directory
+#   mingw-incremental   everything built, one new dl-fldigi commit
+#   mingw-remote        fresh build directory, items in a cache_server.py
+#                       remote cache filled by a cold build
+#   debian-cold         fresh debian.py cache directory
+#   debian-incremental  one new dl-fldigi commit
+#   debian-repeat       nothing changed since the last build
+#
+# "overhead" is wall time minus time spent waiting for build commands.
+# With --baseline, exit status is 1 if any scenario's overhead grew by more
+# than --tolerance compared with a previous --json output.
+
+import sys
+import optparse
+import logging
+import json
+import os
+import os.path
+import shutil
+import stat
+import subprocess
+import tempfile
+import threading
+import time
+import hashlib
+import tarfile
+import BaseHTTPServer
+import SimpleHTTPServer
+import SocketServer
+
+import mingw
+import debian
+import cache_server
+
+logger = logging.getLogger("benchmark")
+
+SCENARIOS = ["mingw-cold", "mingw-warm", "mingw-incremental", "mingw-remote",
+             "debian-cold", "debian-incremental", "debian-repeat"]
+
+# The stand-in for every tool. Its behaviour is set with BENCH_*
+# environment variables, and it does just enough for the Builders to find
+# the files they expect afterwards.
+STUB = r'''#!{python}
+import os, sys, time, glob, tarfile
+
+name = os.path.basename(sys.argv[0])
+args = sys.argv[1:]
+
+time.sleep(float(os.environ.get("BENCH_SLEEP", "0")))
+end = time.time() + float(os.environ.get("BENCH_CPU", "0"))
+while time.time() < end:
+    pass
+
+line = (name + " " + " ".join(args))[:78].ljust(78) + "\n"
+for i in range(int(os.environ.get("BENCH_OUTPUT", "0")) // len(line)):
+    sys.stdout.write(line)
+
+def version():
+    srcdir = "."
+    if os.path.exists(".bench-srcdir"):
+        with open(".bench-srcdir") as f:
+            srcdir = f.read()
+    with open(os.path.join(srcdir, "VERSION")) as f:
+        return f.read().strip()
+
+if name == "configure":
+    # VPATH builds run configure from another directory
+    with open(".bench-srcdir", "w") as f:
+        f.write(os.path.dirname(os.path.abspath(sys.argv[0])))
+    if os.path.exists("VERSION"):
+        with open("Makefile", "w") as f:
+            f.write("VERSION = " + version() + "\n")
+    for a in args:
+        if a.startswith("LDFLAGS="):
+            with open(".bench-ldflags", "w") as f:
+                f.write(a[len("LDFLAGS="):])
+        if a.startswith("--prefix="):
+            with open(".bench-prefix", "w") as f:
+                f.write(a[len("--prefix="):])
+elif name == "make" and "install" in args and \
+        os.path.exists(".bench-prefix"):
+    with open(".bench-prefix") as f:
+        prefix = f.read()
+    for d in ["include", "lib/pkgconfig"]:
+        if not os.path.isdir(os.path.join(prefix, d)):
+            os.makedirs(os.path.join(prefix, d))
+    lib = "lib" + os.path.basename(prefix) + ".a"
+    with open(os.path.join(prefix, "lib", lib), "w") as f:
+        f.write("\0" * int(os.environ.get("BENCH_LIB_SIZE", "0")))
+elif name == "make" and "dist" in args:
+    top = "dl-fldigi-" + version()
+    with tarfile.open(top + ".tar.gz", "w:gz") as t:
+        for fn in os.listdir("."):
+            if fn != ".git" and not fn.endswith(".tar.gz"):
+                t.add(fn, os.path.join(top, fn))
+elif name == "make" and "hamlib-static" in args:
+    # "Link" dl-fldigi, writing a map that lists every library
+    if not os.path.isdir("src"):
+        os.mkdir("src")
+    with open(os.path.join("src", "dl-fldigi.exe"), "w") as f:
+        f.write("\0" * 4096)
+    with open(".bench-ldflags") as f:
+        ldflags = f.read().split()
+    libs = set()
+    for flag in ldflags:
+        if flag.startswith("-L"):
+            items = os.path.dirname(os.path.dirname(flag[2:]))
+            libs.update(glob.glob(os.path.join(items, "*", "lib", "*.a")))
+    for flag in ldflags:
+        if flag.startswith("-Wl,-Map,"):
+            with open(flag[len("-Wl,-Map,"):], "w") as f:
+                f.write("Linker script and memory map\n\n")
+                for lib in sorted(libs):
+                    f.write(" .text 0x00401000 0x{0:x} {1}(a.o)\n"
+                            .format(os.path.getsize(lib) + 1, lib))
+elif name.endswith("-objcopy") and "--only-keep-debug" in args:
+    open(args[-1], "w").close()
+elif name == "make" and "nsisinst" in args:
+    if not os.path.isdir("src"):
+        os.mkdir("src")
+    open(os.path.join("src", "dl-fldigi-" + version() + "_setup.exe"),
+         "w").close()
+elif name == "debuild":
+    prefix = os.path.join("..", os.path.basename(os.getcwd())
+                          .replace("dl-fldigi-", "dl-fldigi_", 1))
+    if "-S" in args:
+        for ext in [".debian.tar.gz", ".dsc"]:
+            open(prefix + ext, "w").close()
+    else:
+        open(prefix + "_i386.deb", "w").close()
+elif name == "lsb_release":
+    sys.stdout.write("Description:\tDebian GNU/Linux 6.0 (squeeze)\n")
+elif name == "makensis":
+    sys.stdout.write("v2.46\n")
+'''
+
+STUB_TOOLS = ["make", "autoconf", "autoreconf", "debuild", "makensis",
+              "lsb_release", "dpkg-checkbuilddeps"] + \
+             [mingw.MINGW_NAME + "-" + n for n in mingw.FAKEPATH_TOOLS]
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    bytes_served = 0
+
+class Handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    def translate_path(self, path):
+        return os.path.join(self.server.directory,
+                            os.path.basename(path.split("?")[0]))
+
+    def copyfile(self, source, outputfile):
+        self.server.bytes_served += os.fstat(source.fileno()).st_size
+        shutil.copyfileobj(source, outputfile)
+
+    def log_message(self, format, *args):
+        pass
+
+class Timed:
+    """Mixin recording the time each Builder spends in build commands."""
+
+    def timed(self, f, *args, **kwargs):
+        start = time.time()
+        try:
+            return f(self, *args, **kwargs)
+        finally:
+            self.command_time = getattr(self, "command_time", 0) + \
+                                time.time() - start
+            self.commands = getattr(self, "commands", 0) + 1
+
+class MingwBuilder(Timed, mingw.Builder):
+    def src_cmd(self, *args, **kwargs):
+        return self.timed(mingw.Builder.src_cmd, *args, **kwargs)
+
+class DebianBuilder(Timed, debian.Builder):
+    def cmd(self, *args, **kwargs):
+        return self.timed(debian.Builder.cmd, *args, **kwargs)
+
+class Benchmark:
+    def main(self):
+        logging.basicConfig(level=logging.INFO,
+                format="[%(asctime)s] %(message)s")
+        self.get_options()
+
+        if self.options["verbose"]:
+            logging.getLogger().setLevel(level=logging.DEBUG)
+
+        self.work = tempfile.mkdtemp(prefix="bench-")
+        self.old_cwd = os.getcwd()
+        self.old_environ = os.environ.copy()
+
+        try:
+            self.setup()
+            results = self.run_all()
+        finally:
+            self.teardown()
+
+        self.report(results)
+
+        if self.options["json"]:
+            with open(self.options["json"], "w") as f:
+                json.dump(results, f, indent=4)
+
+        if self.options["baseline"] and not self.compare(results):
+            sys.exit(1)
+
+    def get_options(self):
+        parser = optparse.OptionParser(usage="%prog [scenario...]")
+        parser.add_option("-n", "--items", dest="items", type="int",
+                help="number of synthetic dependencies", default=12)
+        parser.add_option("--sleep", dest="sleep", type="float",
+                help="seconds each stub command sleeps", default=0.01)
+        parser.add_option("--cpu", dest="cpu", type="float",
+                help="seconds of CPU each stub command burns", default=0)
+        parser.add_option("--output", dest="output", type="int",
+                help="bytes of output from each stub command", default=4096)
+        parser.add_option("--tarball-size", dest="tarball_size", type="int",
+                help="bytes of filler in each synthetic tarball",
+                default=256 * 1024)
+        parser.add_option("--lib-size", dest="lib_size", type="int",
+                help="bytes of each stub installed library",
+                default=256 * 1024)
+        parser.add_option("-r", "--repeat", dest="repeat", type="int",
+                help="run each scenario this many times, keeping the best",
+                default=3)
+        parser.add_option("--mingw-args", dest="mingw_args", default="",
+                help="extra options for mingw.py, e.g. --configure-cache")
+        parser.add_option("--debian-args", dest="debian_args", default="",
+                help="extra options for debian.py")
+        parser.add_option("--json", dest="json", metavar="FILE",
+                help="save results as JSON")
+        parser.add_option("--baseline", dest="baseline", metavar="FILE",
+                help="compare overheads with this earlier --json output")
+        parser.add_option("--tolerance", dest="tolerance", type="float",
+                help="allowed fractional overhead increase vs --baseline",
+                default=0.25)
+        parser.add_option("-v", "--verbose", dest="verbose",
+                help="show the Builders' output", action="store_true")
+
+        (options, args) = parser.parse_args()
+        self.options = options.__dict__
+
+        for s in args:
+            if s not in SCENARIOS:
+                parser.error("Unknown scenario " + s)
+        self.scenarios = args or SCENARIOS
+
+    def wloc(self, *args):
+        return os.path.join(self.work, *args)
+
+    def setup(self):
+        for d in ["stubs", "www", "out", "w32_extra", "nsis"]:
+            os.mkdir(self.wloc(d))
+
+        os.environ["PATH"] = self.wloc("stubs") + ":" + os.environ["PATH"]
+        os.environ["BENCH_SLEEP"] = str(self.options["sleep"])
+        os.environ["BENCH_CPU"] = str(self.options["cpu"])
+        os.environ["BENCH_OUTPUT"] = str(self.options["output"])
+        os.environ["BENCH_LIB_SIZE"] = str(self.options["lib_size"])
+        for var in ["AUTHOR", "COMMITTER"]:
+            os.environ["GIT_" + var + "_NAME"] = "benchmark"
+            os.environ["GIT_" + var + "_EMAIL"] = "benchmark@localhost"
+
+        self.write_stubs()
+        self.write_tarballs()
+        self.write_repo()
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.server.directory = self.wloc("www")
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        os.mkdir(self.wloc("remote"))
+        self.remote = cache_server.Server(("127.0.0.1", 0),
+                                          cache_server.Handler)
+        self.remote.directory = self.wloc("remote")
+        thread = threading.Thread(target=self.remote.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.recipes = self.synthetic_recipes()
+
+        # The plugin check looks at a fixed system path.
+        mingw.NSIS_PLUGIN_DIR = self.wloc("nsis")
+        open(self.wloc("nsis", "System.dll"), "w").close()
+
+        # mingw.py looks for w32_extra in the working directory
+        os.chdir(self.work)
+
+    def teardown(self):
+        os.chdir(self.old_cwd)
+        os.environ.clear()
+        os.environ.update(self.old_environ)
+        if hasattr(self, "server"):
+            self.server.shutdown()
+        if hasattr(self, "remote"):
+            self.remote.shutdown()
+        shutil.rmtree(self.work)
+
+    def write_stubs(self):
+        fn = self.wloc("stubs", "stub")
+        with open(fn, "w") as f:
+            f.write(STUB.replace("{python}", sys.executable))
+        os.chmod(fn, stat.S_IRWXU)
+
+        for name in STUB_TOOLS:
+            os.symlink(fn, self.wloc("stubs", name))
+
+    def write_tarballs(self):
+        self.hashes = {}
+
+        for i in range(self.options["items"]):
+            name = "pkg{0}".format(i)
+            top = self.wloc("www", name + "-1.0")
+            os.mkdir(top)
+            shutil.copy(self.wloc("stubs", "stub"),
+                        os.path.join(top, "configure"))
+            with open(os.path.join(top, "filler"), "wb") as f:
+                f.write(os.urandom(self.options["tarball_size"]))
+
+            fn = self.wloc("www", name + ".tar.gz")
+            with tarfile.open(fn, "w:gz") as t:
+                t.add(top, os.path.basename(top))
+            shutil.rmtree(top)
+
+            with open(fn, "rb") as f:
+                self.hashes[name] = hashlib.sha512(f.read()).hexdigest()
+
+    def write_repo(self):
+        self.repo = self.wloc("dl-fldigi")
+        os.mkdir(self.repo)
+        shutil.copy(self.wloc("stubs", "stub"),
+                    os.path.join(self.repo, "configure"))
+        self.git("init", "-q")
+        self.commit()
+
+    def git(self, *args):
+        with open("/dev/null", "w") as null:
+            subprocess.check_call(("git", ) + args, cwd=self.repo,
+                                  stdout=null)
+
+    def commit(self):
+        self.version = getattr(self, "version", 0) + 1
+        with open(os.path.join(self.repo, "VERSION"), "w") as f:
+            f.write("3.{0}".format(self.version))
+        self.git("add", "-A")
+        self.git("commit", "-q", "-m", "Version {0}".format(self.version))
+
+    def synthetic_recipes(self):
+        url = "http://127.0.0.1:{0}/".format(self.server.server_address[1])
+        recipes = []
+
+        for i in range(self.options["items"]):
+            name = "pkg{0}".format(i)
+            # A few layers of dependencies, like the real set
+            depends = ["pkg{0}".format(j) for j in range(i) if j % 4 == 0]
+            recipes.append({
+                "name": name,
+                "version": "1.0",
+                "url": url + name + ".tar.gz",
+                "file": name + ".tar.gz",
+                "sha512": self.hashes[name],
+                "depends": depends,
+                "configure": ["--prefix={prefix}"] + mingw.STD_CONFIGURE,
+                "flag_items": depends,
+                "make": [[], ["install"]],
+                "pkgconfig": [[name + ".pc", name + ".pc"]],
+            })
+
+        recipes.append({
+            "name": "mingw_fakepath",
+            "version": "1",
+            "hook": "mingw_fakepath",
+            "tools": ["{mingw}-" + n for n in mingw.FAKEPATH_TOOLS],
+        })
+        recipes.append({
+            "name": "dl_fldigi",
+            "version": None,
+            "depends": [r["name"] for r in recipes],
+            "hook": "dl_fldigi",
+            "tools": ["git", "autoreconf", "makensis", "{mingw}-g++"],
+        })
+
+        return recipes
+
+    def run_all(self):
+        results = {}
+
+        for scenario in self.scenarios:
+            runs = []
+            for i in range(self.options["repeat"]):
+                runs.append(self.run_scenario(scenario))
+            results[scenario] = min(runs, key=lambda r: r["overhead"])
+
+        return results
+
+    def run_scenario(self, scenario):
+        (target, kind) = scenario.split("-")
+        args = []
+
+        if target == "mingw":
+            if kind == "cold":
+                self.remove("w32_build", "w32_cache")
+            elif kind == "warm":
+                self.remove("w32_build")
+                self.ensure_built("mingw")
+                self.remove("w32_build")
+            elif kind == "remote":
+                # The path prefix checks that cache_server.py ignores it
+                url = "http://127.0.0.1:{0}/cache/" \
+                      .format(self.remote.server_address[1])
+                args = ["-r", url]
+                self.remove("w32_build", "w32_cache", "remote")
+                os.mkdir(self.wloc("remote"))
+                self.ensure_built("mingw", args)
+                self.remove("w32_build")
+            else:
+                self.ensure_built("mingw")
+                self.commit()
+        else:
+            if kind == "cold":
+                self.remove("debian_cache")
+            elif kind == "repeat":
+                self.ensure_built("debian")
+            else:
+                self.ensure_built("debian")
+                self.commit()
+
+        logger.info("Running " + scenario)
+        r = self.measure(target, args)
+        if kind == "remote" and r["remote_hit_rate"] != 1:
+            raise Exception("mingw-remote: items were rebuilt rather than "
+                            "fetched from cache_server.py")
+        return r
+
+    def remove(self, *dirs):
+        for d in dirs:
+            if os.path.exists(self.wloc(d)):
+                shutil.rmtree(self.wloc(d))
+
+    def ensure_built(self, target, args=[]):
+        r = self.measure(target, args)
+        if not r["success"]:
+            raise Exception("Preparatory " + target + " build failed")
+
+    def builder(self, target, args=[]):
+        quiet = [] if self.options["verbose"] else ["-q"]
+
+        if target == "mingw":
+            sys.argv = ["mingw.py", "-o", self.wloc("out")] + quiet + \
+                       self.options["mingw_args"].split() + args + \
+                       [self.repo]
+            return MingwBuilder(self.recipes)
+        else:
+            sys.argv = ["debian.py", "-n", "unstable",
+                        "-o", self.wloc("out")] + quiet + \
+                       self.options["debian_args"].split() + args + \
+                       [self.repo]
+            return DebianBuilder()
+
+    def measure(self, target, args=[]):
+        b = self.builder(target, args)
+        level = logging.getLogger().level
+        served = self.server.bytes_served
+        before = os.times()
+        start = time.time()
+
+        try:
+            b.main()
+        except SystemExit as e:
+            success = not e.code
+        else:
+            success = True
+
+        wall = time.time() - start
+        after = os.times()
+        logging.getLogger().setLevel(level)
+        stats = getattr(b, "stats", {})
+        if target == "mingw":
+            dirs = ["w32_build", "w32_cache"]
+        else:
+            dirs = ["debian_cache"]
+        command_time = getattr(b, "command_time", 0)
+
+        r = {"success": success,
+             "wall": wall,
+             "command_time": command_time,
+             "overhead": wall - command_time,
+             "builder_cpu": (after[0] - before[0]) + (after[1] - before[1]),
+             "commands": getattr(b, "commands", 0),
+             "bytes_downloaded": self.server.bytes_served - served,
+             "bytes_logs": self.du(*[os.path.join(d, "logs")
+                                     for d in dirs]),
+             "bytes_on_disk": self.du(*dirs)}
+
+        for kind in ["tarball", "remote"]:
+            hits = stats.get(kind + "_hits", 0)
+            total = hits + stats.get(kind + "_misses", 0)
+            r[kind + "_hit_rate"] = float(hits) / total if total else None
+
+        hits = stats.get("items_up_to_date", 0)
+        total = hits + stats.get("items_built", 0)
+        r["item_hit_rate"] = float(hits) / total if total else None
+
+        return r
+
+    def du(self, *dirs):
+        total = 0
+        for d in dirs:
+            for (path, dirnames, filenames) in os.walk(self.wloc(d)):
+                for fn in filenames:
+                    total += os.lstat(os.path.join(path, fn)).st_size
+        return total
+
+    def report(self, results):
+        columns = [("wall", "wall", "{0:.2f}s"),
+                   ("overhead", "overhead", "{0:.2f}s"),
+                   ("builder_cpu", "cpu", "{0:.2f}s"),
+                   ("commands", "commands", "{0:d}"),
+                   ("bytes_downloaded", "download", "{0:.0f}k"),
+                   ("bytes_on_disk", "disk", "{0:.0f}k"),
+                   ("tarball_hit_rate", "tarballs", "{0:.0%}"),
+                   ("remote_hit_rate", "remote", "{0:.0%}"),
+                   ("item_hit_rate", "items", "{0:.0%}")]
+
+        sys.stdout.write("{0:20}".format("scenario") +
+                         "".join("{0:>10}".format(h) for (c, h, fmt)
+                                 in columns) + "\n")
+
+        for scenario in self.scenarios:
+            r = results[scenario]
+            cells = []
+            for (c, h, fmt) in columns:
+                v = r[c]
+                if v is None:
+                    cells.append("-")
+                elif c.startswith("bytes"):
+                    cells.append(fmt.format(v / 1024.0))
+                else:
+                    cells.append(fmt.format(v))
+            sys.stdout.write("{0:20}".format(scenario) +
+                             "".join("{0:>10}".format(c) for c in cells) +
+                             ("" if r["success"] else "  FAILED") + "\n")
+
+    def compare(self, results):
+        with open(self.options["baseline"]) as f:
+            baseline = json.load(f)
+
+        ok = True
+        for scenario in self.scenarios:
+            if not results[scenario]["success"]:
+                ok = False
+            if scenario not in baseline:
+                continue
+
+            old = baseline[scenario]["overhead"]
+            new = results[scenario]["overhead"]
+            if new > old * (1 + self.options["tolerance"]):
+                logger.error("{0}: overhead regressed from {1:.2f}s to "
+                             "{2:.2f}s".format(scenario, old, new))
+                ok = False
+
+        return ok
+
+if __name__ == "__main__":
+    Benchmark().main()
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# Copyright 2013 (C) Daniel Richman. License: GNU GPL 3
+
+# A minimal artifact store for mingw.py --remote-cache. Built items are
+# PUT and fetched with GET as <prefix>/<fingerprint>.tar.gz, where the
+# prefix is whatever path the --remote-cache URL has (or is added by a
+# proxy in front) and is ignored. There is no authentication, so only run
+# it on a trusted network.
+
+import optparse
+import logging
+import errno
+import os
+import os.path
+import re
+import shutil
+import tempfile
+import BaseHTTPServer
+import SocketServer
+
+logger = logging.getLogger("cache_server")
+
+KEY_RE = re.compile(r"^/(?:[^?#]*/)?([0-9a-f]{40}\.tar\.gz)$")
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def artifact(self):
+        m = KEY_RE.match(self.path)
+        if not m:
+            self.send_error(404)
+            return None
+        return os.path.join(self.server.directory, m.group(1))
+
+    def send_artifact(self, body):
+        fn = self.artifact()
+        if not fn:
+            return
+
+        try:
+            f = open(fn, "rb")
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            self.send_error(404)
+            return
+
+        with f:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/gzip")
+            self.send_header("Content-Length",
+                             str(os.fstat(f.fileno()).st_size))
+            self.end_headers()
+            if body:
+                shutil.copyfileobj(f, self.wfile)
+
+    def do_HEAD(self):
+        self.send_artifact(False)
+
+    def do_GET(self):
+        self.send_artifact(True)
+
+    def do_PUT(self):
+        fn = self.artifact()
+        if not fn:
+            return
+
+        try:
+            length = int(self.headers["Content-Length"])
+        except (TypeError, ValueError):
+            self.send_error(411)
+            return
+
+        # Write to a temporary file and rename, so that concurrent GETs
+        # never see a partial upload.
+        (fd, tmp) = tempfile.mkstemp(dir=self.server.directory,
+                                     prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while length:
+                    d = self.rfile.read(min(length, 65536))
+                    if not d:
+                        raise IOError("Upload truncated")
+                    f.write(d)
+                    length -= len(d)
+            os.chmod(tmp, 0o644)
+            os.rename(tmp, fn)
+        except:
+            os.unlink(tmp)
+            raise
+
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.info(self.address_string() + " " + (format % args))
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+def main():
+    logging.basicConfig(level=logging.INFO,
+            format="[%(asctime)s] %(message)s")
+
+    parser = optparse.OptionParser(usage="%prog directory")
+    parser.add_option("-b", "--bind", dest="bind",
+            help="listen on this address", default="")
+    parser.add_option("-p", "--port", dest="port", type="int",
+            help="listen on this port", default=8123)
+
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("Expected single argument: storage directory")
+
+    server = Server((options.bind, options.port), Handler)
+    server.directory = os.path.realpath(args[0])
+
+    if not os.path.isdir(server.directory):
+        parser.error(server.directory + " is not a directory")
+
+    logger.info("Serving " + server.directory + " on port " +
+                str(server.server_address[1]))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# Copyright 2013 (C) Daniel Richman. License: GNU GPL 3
+
+# Shared by debian.py and mingw.py: runs build commands with their output
+# going to a gzipped log file instead of /dev/null. A reader thread drains
+# the child's pipe into a bounded queue, and a writer thread compresses
+# from that queue to the log, so the child only waits on the disk once
+# QUEUE_LINES lines are backed up. The last few lines are kept in memory
+# to be shown if the command fails.
+
+import sys
+import gzip
+import Queue
+import logging
+import threading
+import subprocess
+import collections
+
+logger = logging.getLogger("builder")
+
+QUEUE_LINES = 10000
+
+class Capture:
+    def __init__(self, filename, lines=40, echo=False):
+        self.filename = filename
+        self.log = gzip.open(filename, "wb")
+        self.ring = collections.deque(maxlen=lines)
+        self.echo = echo
+        self.error = None
+
+        self.queue = Queue.Queue(QUEUE_LINES)
+        self.writer = threading.Thread(target=self.write)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def call(self, args, **kwargs):
+        # Callers that want stdout (cmd_output) still get stderr captured.
+        if "stdout" in kwargs and "stderr" in kwargs:
+            return subprocess.call(args, **kwargs)
+        elif "stdout" in kwargs:
+            kwargs["stderr"] = subprocess.PIPE
+        else:
+            kwargs["stdout"] = subprocess.PIPE
+            kwargs["stderr"] = subprocess.STDOUT
+
+        line = "$ " + " ".join(args) + "\n"
+        self.queue.put(line)
+        self.ring.append(line)
+
+        p = subprocess.Popen(args, bufsize=-1, **kwargs)
+        pipe = p.stdout if kwargs["stdout"] == subprocess.PIPE else p.stderr
+
+        reader = threading.Thread(target=self.drain, args=(pipe, ))
+        reader.daemon = True
+        reader.start()
+
+        ret = p.wait()
+        reader.join()
+        pipe.close()
+
+        return ret
+
+    def drain(self, pipe):
+        for line in iter(pipe.readline, ""):
+            self.queue.put(line)
+            self.ring.append(line)
+            if self.echo:
+                sys.stdout.write(line)
+
+    def write(self):
+        # After an error, keep emptying the queue so readers don't block.
+        for line in iter(self.queue.get, None):
+            if self.error:
+                continue
+            try:
+                self.log.write(line)
+            except Exception as e:
+                self.error = e
+
+    def show_tail(self):
+        lines = "".join(self.ring).rstrip("\n")
+        logger.error("Last {0} lines of output (full log in {1}):\n{2}"
+                     .format(len(self.ring), self.filename, lines))
+
+    def close(self):
+        self.queue.put(None)
+        self.writer.join()
+        self.log.close()
+        if self.error:
+            logger.error("Could not write " + self.filename + ": " +
+                         str(self.error))
@@ -11,10 +11,48 @@ import logging
 import optparse
 import re
 import errno
+import json
+import hashlib
+import tempfile
+import threading
 import email.utils
 
+import watcher
+import capture
+import preflight
+import autotools_cache
+import profiles
+import metrics
+import paths
+
 logger = logging.getLogger("builder")
 
+# How many stored results to keep in the cache directory
+KEEP_RESULTS = 10
+
+class Background(threading.Thread):
+    """Runs f(*args) in a thread; join() raises anything it raised."""
+
+    def __init__(self, f, *args):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.f = f
+        self.args = args
+        self.error = None
+        self.start()
+
+    def run(self):
+        try:
+            self.f(*self.args)
+        except Exception as e:
+            logger.debug("Error in background task", exc_info=True)
+            self.error = e
+
+    def join(self):
+        threading.Thread.join(self)
+        if self.error:
+            raise self.error
+
 class Builder:
     def main(self):
         logging.basicConfig(level=logging.INFO,
@@ -27,32 +65,233 @@ class Builder:
         elif self.options["quiet"]:
             logging.getLogger().setLevel(level=logging.WARNING)
 
+        self.capture = None
+        self.autotools_cache = None
+        self.watcher = None
+        self.metrics = metrics.Metrics("debian")
+        self.stats = {"result_hits": 0, "result_misses": 0}
+
         try:
-            self.null = open("/dev/null", "w")
-            self.setup_build_dir()
+            with self.metrics.phase("setup"):
+                self.open_cache_dir()
+                if self.options["preflight"]:
+                    self.preflight()
+                if self.options["autotools_cache"]:
+                    self.autotools_cache = autotools_cache.AutotoolsCache(
+                            self.cloc("autotools"))
+                self.distro = self.options["distro"]
+                if not self.distro:
+                    self.distro = self.default_distro()
         except:
             logger.exception("Error in setup")
+            self.write_metrics(False)
+            sys.exit(1)
+
+        if self.options["watch"]:
+            self.watch()
+            ok = True
+        else:
+            ok = self.build_commit(self.dl_fldigi_commit)
+
+        if not ok:
             sys.exit(1)
 
+    def watch(self):
+        status_file = self.options["status_file"] or self.cloc("status.json")
+        w = watcher.Watcher(self.dl_fldigi_source, self.dl_fldigi_commit,
+                            self.cloc("dl-fldigi.git"), status_file,
+                            self.options["poll_interval"],
+                            self.options["settle"])
+
+        # Builds clone from the local mirror, which Watcher keeps fetched.
+        self.dl_fldigi_source = w.mirror
+        self.watcher = w
+        w.run(self.build_commit)
+
+    def build_commit(self, commit):
+        self.metrics.start_build()
+        ok = self.build_or_restore(commit)
+        self.write_metrics(ok)
+        return ok
+
+    def build_or_restore(self, commit):
+        self.dl_fldigi_commit = commit
+
+        try:
+            key = self.result_key()
+        except:
+            logger.exception("Could not look up stored results")
+            key = None
+
+        if key and not self.options["force"]:
+            try:
+                if self.restore_result(key):
+                    self.stats["result_hits"] += 1
+                    return True
+            except:
+                logger.exception("Error restoring stored result")
+
+        if key:
+            self.stats["result_misses"] += 1
+
+        try:
+            self.setup_build_dir()
+        except:
+            logger.exception("Error in setup")
+            return False
+
         delay_error = False
+        self.debian_prep = None
+        self.git_cleanup = None
 
         try:
-            self.get_orig_tar()
-            self.add_debian_dir()
-            self.build()
-            self.get_files()
+            for stage in (self.get_orig_tar, self.add_debian_dir,
+                          self.build, self.get_files):
+                self.run_stage(stage)
         except:
             delay_error = True
             logger.exception("Error in build")
 
+        # Whether or not they failed, they must finish before the build
+        # directory is removed.
+        for task in (self.debian_prep, self.git_cleanup):
+            if task:
+                try:
+                    task.join()
+                except:
+                    logger.debug("Background task failed", exc_info=True)
+
+        if key and not delay_error:
+            try:
+                self.store_result(key)
+            except:
+                logger.exception("Error storing result")
+
         try:
-            self.null.close()
             self.clean_build_dir()
         except:
             logger.exception("Error whilst cleaning up")
 
-        if delay_error:
-            sys.exit(1)
+        return not delay_error
+
+    def run_stage(self, stage):
+        # Each stage's command output goes to its own log in the cache
+        # directory, since the build directory is removed afterwards.
+        fn = self.cloc("logs", stage.__name__ + ".log.gz")
+        self.capture = capture.Capture(fn, self.options["log_lines"],
+                                       self.options["verbose"])
+        try:
+            with self.metrics.phase(stage.__name__):
+                stage()
+        finally:
+            self.capture.close()
+            self.capture = None
+
+    def write_metrics(self, success):
+        if not self.options["metrics"]:
+            return
+
+        m = self.metrics
+        m.cache("result", self.stats["result_hits"],
+                self.stats["result_misses"])
+        if self.autotools_cache:
+            m.cache("autotools", self.autotools_cache.hits,
+                    self.autotools_cache.misses)
+        if self.watcher:
+            m.cache("mirror", self.watcher.mirror_hits,
+                    self.watcher.mirror_misses)
+
+        try:
+            m.write(self.options["metrics"], success)
+        except:
+            logger.exception("Error writing metrics")
+
+    def result_key(self):
+        """Identify a build by what goes into it, or None if unknown."""
+
+        commit = self.resolve_commit()
+        if not commit:
+            logger.info("Could not resolve the dl-fldigi commit; not using "
+                        "stored results")
+            return None
+
+        # Build exactly the commit the key names: were the branch checked
+        # out instead, a push after ls-remote would store another commit's
+        # packages under this one's key.
+        self.dl_fldigi_commit = commit
+
+        h = hashlib.sha1()
+        for (path, dirnames, filenames) in os.walk(self.debian_dir()):
+            dirnames.sort()
+            for fn in sorted(filenames):
+                full = os.path.join(path, fn)
+                with open(full, "rb") as f:
+                    h.update(os.path.relpath(full, self.debian_dir()) +
+                             "\0" + hashlib.sha1(f.read()).digest())
+
+        return hashlib.sha1(json.dumps([
+            commit, self.distro, h.hexdigest(), self.options["get_src"],
+            self.options["profile"], self.options["target_cpu"],
+            self.options["lto"]])).hexdigest()
+
+    def resolve_commit(self):
+        commit = self.dl_fldigi_commit
+        if commit and re.match(r"^[0-9a-f]{40}$", commit):
+            return commit
+
+        # A branch, tag or HEAD; abbreviated hashes can't be resolved
+        # without a clone.
+        out = self.cmd_output("git", "ls-remote", self.dl_fldigi_source,
+                              commit or "HEAD", cwd=None)
+        shas = set(line.split()[0] for line in out.splitlines())
+        if len(shas) != 1:
+            return None
+        return shas.pop()
+
+    def restore_result(self, key):
+        stored = self.cloc("results", key)
+        if not os.path.isdir(stored):
+            return False
+
+        logger.info("Using stored result " + key + " (--force rebuilds)")
+        for fn in sorted(os.listdir(stored)):
+            self.copy_output(os.path.join(stored, fn), fn)
+        os.utime(stored, None)
+        return True
+
+    def store_result(self, key):
+        results = self.cloc("results")
+        if not os.path.isdir(results):
+            os.mkdir(results)
+
+        # Copy and rename, so a partial result is never mistaken for one.
+        tmp = tempfile.mkdtemp(dir=results, prefix=".store-")
+        try:
+            for (path, name) in self.output_files:
+                shutil.copy(path, os.path.join(tmp, name))
+            if os.path.isdir(self.cloc("results", key)):
+                shutil.rmtree(self.cloc("results", key)) # --force
+            os.rename(tmp, self.cloc("results", key))
+        except:
+            shutil.rmtree(tmp)
+            raise
+
+        logger.debug("Stored result " + key)
+        self.prune_results()
+
+    def prune_results(self):
+        """Remove all but the KEEP_RESULTS most recently used results."""
+
+        results = self.cloc("results")
+        entries = []
+        for name in os.listdir(results):
+            if not name.startswith("."):
+                path = os.path.join(results, name)
+                entries.append((os.stat(path).st_mtime, path))
+
+        for (mtime, path) in sorted(entries, reverse=True)[KEEP_RESULTS:]:
+            logger.debug("Removing stored result " + os.path.basename(path))
+            shutil.rmtree(path, ignore_errors=True)
 
     def get_options(self):
         parser = optparse.OptionParser(usage="%prog git-source [git-commit]")
@@ -70,6 +309,46 @@ class Builder:
                 help="pass -j to make for speedy builds")
         parser.add_option("-n", "--distro-name", dest="distro",
                 help="distro to build for")
+        parser.add_option("-p", "--profile", dest="profile",
+                help="optimisation profile: " + ", ".join(profiles.names()),
+                type="choice", choices=profiles.names(), default="default")
+        parser.add_option("--target-cpu", dest="target_cpu", metavar="CPU",
+                help="build for this -march (default: the distro's)")
+        parser.add_option("--lto", dest="lto", action="store_true",
+                help="enable link time optimisation")
+        parser.add_option("--log-lines", dest="log_lines", type="int",
+                help="show this many lines of a failed command's output "
+                     "(full logs are kept in the cache directory)",
+                default=40)
+        parser.add_option("--autotools-cache", dest="autotools_cache",
+                help="restore autoreconf's outputs from the cache directory "
+                     "when configure.ac, *.am and *.m4 are unchanged "
+                     "(unsafe if configure.ac reads other files)",
+                action="store_true")
+        parser.add_option("--no-preflight", dest="preflight",
+                help="skip checking tools and Build-Depends before building",
+                action="store_false", default=True)
+        parser.add_option("-f", "--force", dest="force", action="store_true",
+                help="build even if the result of an identical build is "
+                     "stored in the cache directory")
+        parser.add_option("-c", "--cache", dest="cache",
+                help="keep logs, autotools outputs, results and the --watch "
+                     "mirror here",
+                metavar="DIR", default="debian_cache")
+        parser.add_option("-w", "--watch", dest="watch",
+                help="keep running, building each new commit of git-commit "
+                     "(a branch; default HEAD)", action="store_true")
+        parser.add_option("--poll-interval", dest="poll_interval", type="int",
+                help="seconds between polls in --watch mode", default=60)
+        parser.add_option("--settle", dest="settle", type="int",
+                help="wait until no new commits have arrived for this many "
+                     "seconds before building", default=30)
+        parser.add_option("--status-file", dest="status_file",
+                help="where --watch writes its queue and status "
+                     "(default: status.json in the cache directory)")
+        parser.add_option("--metrics", dest="metrics", metavar="FILE",
+                help="write timings and cache statistics here, for "
+                     "node_exporter's textfile collector (name it *.prom)")
 
         (options, args) = parser.parse_args()
         self.options = options.__dict__
@@ -83,11 +362,52 @@ class Builder:
         self.dl_fldigi_commit = args[1]
 
     def default_distro(self):
-        distributor = self.cmd_output("lsb_release", "-si").strip()
+        distributor = self.cmd_output("lsb_release", "-si", cwd=None).strip()
         if distributor == "Debian":
             return "unstable"
         else:
-            return self.cmd_output("lsb_release", "-sc").strip()
+            return self.cmd_output("lsb_release", "-sc", cwd=None).strip()
+
+    def debian_dir(self, *args):
+        script_loc = os.path.dirname(os.path.realpath(__file__))
+        return os.path.join(script_loc, "debian", *args)
+
+    def preflight(self):
+        tools = ["git", "autoreconf", "make", "tar", "debuild",
+                 "dpkg-checkbuilddeps"]
+        if not self.options["distro"]:
+            tools.append("lsb_release")
+        files = ["changelog", "compat", "control", "rules",
+                 os.path.join("source", "format")]
+
+        checks = [self.check_build_depends]
+        checks += [lambda t=t: preflight.check_executable(paths.find_path, t)
+                   for t in tools]
+        checks += [lambda f=f: self.check_debian_file(f) for f in files]
+
+        preflight.run(checks)
+
+    def check_debian_file(self, name):
+        if not os.path.isfile(self.debian_dir(name)):
+            return ["Missing " + self.debian_dir(name)]
+        return []
+
+    def check_build_depends(self):
+        (ret, out) = preflight.command_output(
+                ("dpkg-checkbuilddeps", self.debian_dir("control")))
+        if ret is None:
+            return [] # reported by the dpkg-checkbuilddeps tool check
+        if ret != 0:
+            return [out]
+        return []
+
+    def open_cache_dir(self):
+        self.cache = os.path.realpath(self.options["cache"])
+        logger.debug("Cache directory is " + self.cache)
+        paths.open_dir(self.cache)
+
+        if not os.path.isdir(self.cloc("logs")):
+            os.mkdir(self.cloc("logs"))
 
     def setup_build_dir(self):
         self.location = os.path.realpath(self.options["directory"])
@@ -113,23 +433,31 @@ class Builder:
     def cmd(self, *args, **kwargs):
         logger.debug("Executing: " + repr(args) + " " + repr(kwargs))
 
-        if not self.options["verbose"]:
-            if "stdout" not in kwargs:
-                kwargs["stdout"] = self.null
-            if "stderr" not in kwargs:
-                kwargs["stderr"] = self.null
-
         if "cwd" not in kwargs:
             kwargs["cwd"] = self.location
 
-        ret = subprocess.call(args, **kwargs)
+        if self.capture:
+            ret = self.capture.call(args, **kwargs)
+        elif self.options["verbose"]:
+            ret = subprocess.call(args, **kwargs)
+        else:
+            # Outside a stage (lsb_release, git ls-remote) there's no log
+            with open(os.devnull, "w") as null:
+                kwargs.setdefault("stdout", null)
+                kwargs.setdefault("stderr", null)
+                ret = subprocess.call(args, **kwargs)
 
         if ret != 0:
+            if self.capture:
+                self.capture.show_tail()
             raise Exception("subprocess error exited " + repr(args))
 
     def loc(self, *args):
         return os.path.join(self.location, *args)
 
+    def cloc(self, *args):
+        return os.path.join(self.cache, *args)
+
     def cmd_output(self, *args, **kwargs):
         # Only works for small outputs
 
@@ -155,16 +483,15 @@ class Builder:
         self.cmd("git", "submodule", "init", cwd=g)
         self.cmd("git", "submodule", "update", cwd=g)
 
-        self.cmd("autoreconf", "-vfi", cwd=g)
+        if self.autotools_cache:
+            self.autotools_cache.run(g, ("autoreconf", "-vfi"), self.cmd)
+        else:
+            self.cmd("autoreconf", "-vfi", cwd=g)
         self.cmd("./configure", cwd=g)
-        self.cmd("make", "dist", cwd=g)
 
-        search = glob.glob(self.loc("git-tmp", "dl-fldigi-*.tar.gz"))
-        assert len(search) == 1
-        distname = os.path.basename(search[0])
-        assert distname.startswith("dl-fldigi-")
-        assert distname.endswith(".tar.gz")
-        self.version = distname[len("dl-fldigi-"):-len(".tar.gz")]
+        # Everything the debian directory needs is known now, so it is
+        # prepared while make dist runs.
+        self.version = self.makefile_version(g)
         logger.info("Version is " + self.version)
 
         line = self.cmd_output("git", "log", "--oneline", "-1", cwd=g)
@@ -174,54 +501,109 @@ class Builder:
 
         logger.info("Git commit is " + self.git)
 
+        self.debsrc = "dl-fldigi-" + self.version + "." + self.git
         self.origname = "dl-fldigi_" + self.version + "." + \
                 self.git + ".orig.tar.gz"
         logger.info("Orig tarball is " + self.origname)
 
-        shutil.copy(self.loc("git-tmp", distname),
-                    self.loc(self.origname))
-        shutil.rmtree(self.loc("git-tmp"))
+        self.debian_prep = Background(self.prepare_debian_dir)
 
-    def add_debian_dir(self):
-        self.debsrc = "dl-fldigi-" + self.version + "." + self.git
-        t = self.loc(self.debsrc)
+        self.cmd("make", "dist", cwd=g)
 
-        os.mkdir(t)
-        self.cmd("tar", "xfC", self.loc(self.origname), t,
-                 "--strip-components=1")
+        distname = "dl-fldigi-" + self.version + ".tar.gz"
+        if not os.path.exists(self.loc("git-tmp", distname)):
+            raise Exception("make dist did not produce " + distname)
 
-        script_loc = os.path.dirname(os.path.realpath(__file__))
-        debian = os.path.join(script_loc, "debian")
-        shutil.copytree(debian, self.loc(self.debsrc, "debian"))
+        self.unpack_orig(self.loc("git-tmp", distname))
+        self.git_cleanup = Background(shutil.rmtree, g)
+
+    def makefile_version(self, srcdir):
+        with open(os.path.join(srcdir, "Makefile")) as f:
+            for line in f:
+                m = re.match(r"^VERSION\s*=\s*(\S+)\s*$", line)
+                if m:
+                    return m.group(1)
+        raise Exception("No VERSION in " + os.path.join(srcdir, "Makefile"))
+
+    def unpack_orig(self, dist):
+        # Read the tarball once, writing the orig tarball and feeding tar
+        # at the same time.
+        t = self.loc(self.debsrc)
+        os.mkdir(t)
 
-        changelog_file = self.loc(self.debsrc, "debian", "changelog")
+        args = ("tar", "xzC", t, "--strip-components=1")
+        logger.debug("Executing: " + repr(args))
+
+        with tempfile.TemporaryFile() as errors:
+            tar = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                   stdout=errors, stderr=errors)
+            try:
+                with open(dist, "rb") as src:
+                    with open(self.loc(self.origname), "wb") as orig:
+                        for block in iter(lambda: src.read(65536), ""):
+                            orig.write(block)
+                            tar.stdin.write(block)
+            except IOError as e:
+                if e.errno != errno.EPIPE:
+                    raise
+            finally:
+                tar.stdin.close()
+                ret = tar.wait()
+
+            if ret != 0:
+                errors.seek(0)
+                logger.error("tar output:\n" + errors.read().strip())
+                raise Exception("subprocess error exited " + repr(args))
+
+    def prepare_debian_dir(self):
+        staging = self.loc("debian-staging")
+        shutil.copytree(self.debian_dir(), staging)
+
+        changelog_file = os.path.join(staging, "changelog")
 
         with open(changelog_file) as f:
             changelog = f.read()
 
-        distro = self.options["distro"]
-        if not distro:
-            distro = self.default_distro()
-
         changelog = changelog.format(version=self.version + "." + self.git,
-                                     distro=distro, commit=self.git,
+                                     distro=self.distro, commit=self.git,
                                      date=email.utils.formatdate())
 
         with open(changelog_file, "w") as f:
             f.write(changelog)
 
+    def add_debian_dir(self):
+        self.debian_prep.join()
+        os.rename(self.loc("debian-staging"),
+                  self.loc(self.debsrc, "debian"))
+
     def build(self):
+        # debuild sanitises the environment, so the profile's flags are
+        # passed through it, to dpkg-buildflags. Its own options come
+        # before dpkg-buildpackage's.
         args = []
+        flags = profiles.flags(self.options["profile"],
+                               self.options["target_cpu"],
+                               self.options["lto"], cross=False,
+                               append=True)
+        for (var, value) in sorted(flags.items()):
+            if value:
+                args.append("--set-envvar=DEB_{0}_APPEND={1}".format(
+                            var, " ".join(value)))
+        if not profiles.strip(self.options["profile"]):
+            args.append("--set-envvar=DEB_BUILD_OPTIONS=nostrip")
+
+        args += ["-uc", "-us"]
         if self.options["make_jobs"]:
             args.append("-j" + self.options["make_jobs"])
 
         if self.options["get_src"]:
             args.append("-S")
 
-        self.cmd("debuild", "-uc", "-us", *args, cwd=self.loc(self.debsrc))
+        self.cmd("debuild", *args, cwd=self.loc(self.debsrc))
 
     def get_files(self):
         prefix = "dl-fldigi_" + self.version + "." + self.git
+        self.output_files = []
 
         if self.options["get_src"]:
             files = [prefix + ".orig.tar.gz", prefix + ".debian.tar.gz",
@@ -229,16 +611,40 @@ class Builder:
             assert files[0] == self.origname
 
             for fn in files:
-                logger.info("Copying " + fn)
-                shutil.copy(self.loc(fn), self.options["output"])
+                self.output_files.append((self.loc(fn), fn))
         else:
             name = prefix + "_*.deb"
             search = glob.glob(self.loc(name))
             assert len(search) == 1
             deb = search[0]
 
-            logger.info("Copying output deb " + os.path.basename(deb))
-            shutil.copy(deb, self.options["output"])
+            name = profiles.artifact_name(os.path.basename(deb),
+                                          self.options["profile"])
+            self.output_files.append((deb, name))
+
+        for (path, name) in self.output_files:
+            self.copy_output(path, name)
+
+    def copy_output(self, path, name):
+        output = self.options["output"]
+        if os.path.isdir(output):
+            output = os.path.join(output, name)
+
+        size = os.path.getsize(path)
+        logger.info("Copying {0} ({1} kB)".format(name, size // 1024))
+        shutil.copy(path, output)
+        self.metrics.set("artifact_size_bytes", size,
+                         "Size of each saved installer or package",
+                         artifact=self.artifact_kind(name),
+                         profile=self.options["profile"])
+
+    def artifact_kind(self, name):
+        for (suffix, kind) in ((".orig.tar.gz", "orig"),
+                               (".debian.tar.gz", "debian"),
+                               (".dsc", "dsc"), (".deb", "deb")):
+            if name.endswith(suffix):
+                return kind
+        return "other"
 
 
 if __name__ == "__main__":
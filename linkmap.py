@@ -0,0 +1,91 @@
+# Copyright 2013 (C) Daniel Richman. License: GNU GPL 3
+
+# Reads the map file GNU ld writes with -Wl,-Map, to find out which
+# archive members ended up in a binary and how much each contributed.
+# Input sections are listed under their output section, either on one
+# line:
+#
+#    .text          0x00401000      0x1c4 /x/items/zlib/lib/libz.a(crc32.o)
+#
+# or, when the section name is long, with the name on a line of its own.
+
+import os.path
+import re
+import collections
+
+SECTION = re.compile(r"^ (\S+)?\s+0x([0-9a-f]+)\s+0x([0-9a-f]+)\s+(\S.*)$")
+MEMBER = re.compile(r"^(.*\.a)\((.*)\)$")
+
+# Sections that take no space in the stripped binary
+SKIP_SECTIONS = (".debug", ".stab", ".comment", ".bss", ".gnu.lto")
+
+def parse(filename):
+    """Return a list of (section, size, archive, member) tuples.
+
+    archive is None for objects linked directly.
+    """
+
+    entries = []
+    started = False
+    section = None
+
+    with open(filename) as f:
+        for line in f:
+            line = line.rstrip("\n")
+
+            if not started:
+                started = line.startswith("Linker script and memory map")
+                continue
+
+            if line.startswith(" ") and len(line.split()) == 1:
+                # Long input section name; the rest is on the next line
+                section = line.split()[0]
+                continue
+
+            m = SECTION.match(line)
+            if not m:
+                section = None
+                continue
+
+            (name, address, size, path) = m.groups()
+            name = name or section
+            section = None
+            size = int(size, 16)
+
+            if not name or name.startswith(SKIP_SECTIONS) or not size:
+                continue
+            if name.startswith("*"):
+                continue
+
+            m = MEMBER.match(path)
+            if m:
+                entries.append((name, size, m.group(1), m.group(2)))
+            else:
+                entries.append((name, size, None, path))
+
+    return entries
+
+def library_sizes(entries, items_dir=None):
+    """Total up the bytes that each library contributed.
+
+    Archives under items_dir are named after their item; the rest (libgcc,
+    libstdc++, mingw's runtime) after the archive. Objects linked directly
+    are counted as the program's own.
+    """
+
+    sizes = collections.defaultdict(int)
+    for (section, size, archive, member) in entries:
+        sizes[library_name(archive, items_dir)] += size
+    return dict(sizes)
+
+def library_name(archive, items_dir=None):
+    if archive is None:
+        return "(program)"
+
+    if items_dir:
+        path = os.path.relpath(os.path.realpath(archive),
+                               os.path.realpath(items_dir))
+        if not path.startswith(".."):
+            return path.split(os.sep)[0]
+
+    return os.path.basename(archive)
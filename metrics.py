@@ -0,0 +1,102 @@
+# Copyright 2013 (C) Daniel Richman. License: GNU GPL 3
+
+# Shared by debian.py and mingw.py: collects timings and cache statistics
+# during a run, and with --metrics writes them out in the Prometheus text
+# format for node_exporter's textfile collector. The file is written to a
+# temporary name and renamed into place, so it is never read half written.
+# Counters count since the builder started; in --watch mode the file is
+# rewritten after every build. Labels must come from a small fixed set
+# (no versions or commits), or every build would add new series.
+
+import os
+import os.path
+import time
+import tempfile
+import contextlib
+import collections
+
+PREFIX = "dl_fldigi_builder_"
+
+class Metrics:
+    def __init__(self, builder):
+        self.builder = builder
+        self.families = collections.OrderedDict()
+
+    def set(self, name, value, help, type="gauge", **labels):
+        if name not in self.families:
+            self.families[name] = (type, help, collections.OrderedDict())
+        samples = self.families[name][2]
+        samples[tuple(sorted(labels.items()))] = value
+
+    def start_build(self):
+        """Forget the previous build's timings and sizes.
+
+        Gauges describe one build, so in --watch mode samples from a
+        previous build (of an item since skipped, say) would be stale.
+        Counters, and the one-off setup phase, are kept.
+        """
+
+        for (type, help, samples) in self.families.values():
+            if type == "gauge":
+                for labels in list(samples):
+                    if labels != (("phase", "setup"), ):
+                        del samples[labels]
+
+    @contextlib.contextmanager
+    def timer(self, name, help, **labels):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.set(name, time.time() - start, help, **labels)
+
+    def phase(self, phase):
+        return self.timer("phase_duration_seconds",
+                          "Time taken by each phase of the last build",
+                          phase=phase)
+
+    def cache(self, cache, hits, misses):
+        self.set("cache_hits_total", hits, "Cache hits", "counter",
+                 cache=cache)
+        self.set("cache_misses_total", misses, "Cache misses", "counter",
+                 cache=cache)
+
+    def write(self, filename, success):
+        self.set("success", int(success),
+                 "1 if the last build succeeded, else 0")
+        self.set("last_run_timestamp_seconds", time.time(),
+                 "When the last build finished")
+
+        lines = []
+        for (name, (type, help, samples)) in self.families.items():
+            if not samples:
+                continue
+            lines.append("# HELP {0}{1} {2}\n".format(PREFIX, name, help))
+            lines.append("# TYPE {0}{1} {2}\n".format(PREFIX, name, type))
+            for (labels, value) in samples.items():
+                labels = (("builder", self.builder), ) + labels
+                labels = ",".join('{0}="{1}"'.format(k, escape(v))
+                                  for (k, v) in labels)
+                lines.append("{0}{1}{{{2}}} {3}\n"
+                             .format(PREFIX, name, labels, value_str(value)))
+
+        # node_exporter only reads *.prom, so the temporary file is ignored
+        directory = os.path.dirname(os.path.abspath(filename))
+        (fd, tmp) = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.writelines(lines)
+            os.chmod(tmp, 0o644)
+            os.rename(tmp, filename)
+        except:
+            os.unlink(tmp)
+            raise
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n") \
+                     .replace('"', '\\"')
+
+def value_str(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
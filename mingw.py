@@ -10,45 +10,390 @@ import os
 import os.path
 import re
 import fcntl
-import stat
 import hashlib
 import urllib
+import urllib2
+import urlparse
+import httplib
 import shutil
 import subprocess
 import glob
+import tempfile
+import tarfile
+import threading
+import multiprocessing.pool
+
+import watcher
+import capture
+import preflight
+import autotools_cache
+import profiles
+import metrics
+import linkmap
+import trim
+import paths
 
 logger = logging.getLogger("builder")
 
 MINGW_NAME = "i586-mingw32msvc"
 STD_CONFIGURE = ["--build=i686-pc-linux-gnu", "--host=" + MINGW_NAME,
                  "--enable-static", "--disable-shared"]
+FAKEPATH_TOOLS = ["addr2line", "ar", "as", "c++", "cc", "c++filt", "cpp",
+                  "dlltool", "dllwrap", "g++", "gcc", "gccbug",
+                  "gcov", "gfortran", "gprof", "ld", "nm", "objcopy",
+                  "objdump", "ranlib", "readelf", "size", "strings",
+                  "strip", "windmc", "windres"]
+NSIS_PLUGIN_DIR = "/usr/share/nsis/Plugins"
+# Environment variables that affect configure's probes
+PRECIOUS_ENV = ["CC", "CXX", "CPP", "CFLAGS", "CXXFLAGS", "CPPFLAGS",
+                "LDFLAGS", "LIBS", "PKG_CONFIG_LIBDIR", "PKG_CONFIG_PATH"]
+# What configure prints when it rejects a --cache-file
+CONFIGURE_CACHE_ERRORS = ["has changed since the previous run",
+                          "changes in the environment can compromise",
+                          "and start over"]
+
+# Part of every item's fingerprint. Bump it when a change to the Builder
+# (a hook, say) should rebuild items whose recipes are unchanged.
+RECIPE_FORMAT = 1
+
+# Seconds to wait for the remote cache to connect or send anything
+REMOTE_TIMEOUT = 10
+
+# Each recipe describes one item in the build. Strings in the command lists
+# are formatted with Builder.recipe_vars(): {prefix} is the item's install
+# directory, {items} the parent of all of those, {build} the build directory
+# and {mingw} the cross compiler's name.
+#
+#   name, version       state is keyed on these; version None means "always
+#                       rebuild"
+#   url, file, sha512   source tarball (or .zip), cached as file
+#   depends             items that must be built first
+#   patches             applied with patch -p1 from w32_extra
+#   extra_files         [source in w32_extra, destination dir in {prefix}]
+#   commands            run in the source dir before configure
+#   configure           ./configure arguments
+#   flag_items          items added to CPPFLAGS/LDFLAGS for ./configure
+#   configure_cache     with --configure-cache: "shared" (default) shares
+#                       probe results with other items, "private" keeps a
+#                       cache for this item only, False disables it
+#   env                 extra environment for every command of this item;
+#                       the --profile's CFLAGS etc. are added to it, and an
+#                       argument "{cflags}" expands to the profile's CFLAGS
+#   post_configure      commands run after ./configure
+#   mkdirs              directories created in {prefix} before make
+#   make                list of make invocations (argument lists)
+#   hook                Builder method called after make, for the odd ones
+#   remove              directories in {prefix} that are deleted afterwards
+#   pkgconfig           [name in {build}/pkgconfig, name in lib/pkgconfig]
+#   tools, files        executables and w32_extra files used by the hook,
+#                       for the preflight checks
+#   symlinks            [target, link name], both relative to {prefix}
+RECIPES = [
+    {
+        "name": "pthreadsw32",
+        "version": "2.8.0",
+        "url": "ftp://sourceware.org/pub/pthreads-win32/"
+               "pthreads-w32-2-8-0-release.tar.gz",
+        "file": "pthreadsw32.tar.gz",
+        "sha512": "d86040b18641b52f2de81468e06e2885d0f0ed47cc5c9c90ca33614e"
+                  "d53ddd60167723b46eb477d905ad69f93b6b9002762589ba6c351f78"
+                  "a8041109cdbf287e",
+        "make": [["CROSS={mingw}-", "clean", "GC-inlined"]],
+        "mkdirs": ["include", "lib"],
+        "hook": "pthreadsw32_install",
+        "symlinks": [["lib/libpthreadGC2.a", "lib/libpthread.a"]],
+    },
+    {
+        "name": "zlib",
+        "version": "1.2.7",
+        "url": "http://zlib.net/zlib-1.2.7.tar.gz",
+        "file": "zlib.tar.gz",
+        "sha512": "b1c073ad26684e354f7c522c14655840592e03872bc0a94690f89cae"
+                  "2ff88f146fce1dad252ff27a889dac4a32ff9f8ab63ba940671f9da8"
+                  "9e9ba3e19f1bf58d",
+        "env": {"CC": "{mingw}-gcc", "AR": "{mingw}-ar",
+                "RANLIB": "{mingw}-ranlib", "CFLAGS": "-O2"},
+        # zlib's configure is hand written, and has no --cache-file
+        "configure": ["--prefix={prefix}"],
+        "configure_cache": False,
+        "make": [["LDSHAREDLIBC="], ["install"]],
+        "remove": ["share"],
+    },
+    {
+        "name": "libpng",
+        "version": "1.5.12",
+        "url": "http://downloads.sourceforge.net/libpng/libpng-1.5.12.tar.gz",
+        "file": "libpng.tar.gz",
+        "sha512": "dbefad00fa34f4f21dca0f1e92e95bd55f1f4478fa0095dcf015b4d0"
+                  "6f0c823ff11755cd777e507efaf1c9098b74af18f613ec9000e5c3a5"
+                  "cc1c7554fb5aefb8",
+        "depends": ["zlib"],
+        "configure": ["--prefix={prefix}"] + STD_CONFIGURE,
+        "flag_items": ["zlib"],
+        "make": [[], ["install"]],
+        "remove": ["share"],
+        "pkgconfig": [["libpng.pc", "libpng.pc"]],
+        "symlinks": [["include/libpng15", "include/libpng"]],
+    },
+    {
+        "name": "libjpeg",
+        "version": "6b",
+        "url": "http://downloads.sourceforge.net/libjpeg/jpegsrc.v6b.tar.gz",
+        "file": "libjpeg6b.tar.gz",
+        "sha512": "5d37d3695105fc345ca269ab98cd991472e5de72f702c9a8a652a7d1"
+                  "14a40eb99670c69a87ecb24bf64e96318fc0ee2bcb44c497d9d3d2a6"
+                  "7378c99e4eb348fe",
+        # autoconf 2.12's cache variables don't mix with modern ones
+        "configure": ["--prefix={prefix}", "CC={mingw}-gcc"],
+        "configure_cache": "private",
+        "mkdirs": ["include", "lib"],
+        "make": [["libjpeg.a", "AR={mingw}-ar rc", "AR2={mingw}-ranlib"],
+                 ["install-lib"]],
+    },
+    {
+        "name": "fltk",
+        "version": "1.3.0",
+        "url": "http://ftp.easysw.com/pub/fltk/1.3.0/"
+               "fltk-1.3.0-source.tar.gz",
+        "file": "fltk.tar.gz",
+        "sha512": "a7adf9def90b143bc7ff54ac82fe9f6812b49209ab4145aada45210a"
+                  "3c314f9d91ae413240a8c57492826eca011aa147c68a131a9fe20bf2"
+                  "21e7bc70c6c908ee",
+        "depends": ["libpng", "libjpeg", "zlib", "pthreadsw32"],
+        "patches": ["mingw-fltk.patch"],
+        "commands": [["autoconf"]],
+        "configure": ["--prefix={prefix}", "--enable-threads"] + STD_CONFIGURE,
+        "flag_items": ["libpng", "libjpeg", "zlib", "pthreadsw32"],
+        # DIRS=src switches off building in documentation, test, fluid
+        # directories.
+        "make": [["DIRS=src"], ["DIRS=src", "install"]],
+    },
+    {
+        "name": "directx_devel",
+        "version": "3",
+        "mkdirs": ["include"],
+        "extra_files": [["dsound.h", "include"]],
+    },
+    {
+        "name": "portaudio",
+        "version": "v19_20111121",
+        "url": "http://www.portaudio.com/archives/pa_stable_v19_20111121.tgz",
+        "file": "portaudio.tar.gz",
+        "sha512": "e9d039313ce27ae1f643ef2509ddea7ac6aadca5d39f2f2a4f0ccd8a"
+                  "3661a5a56a29e666300d3d4418cab6231ee14b3c09eb83dca0dd3326"
+                  "e1f24418d035abb2",
+        "depends": ["directx_devel"],
+        "configure": ["--prefix={prefix}", "--with-winapi=wmme,directx",
+                      "--with-dxdir={items}/directx_devel"] + STD_CONFIGURE,
+        "make": [[], ["install"]],
+        "pkgconfig": [["portaudio-2.0.pc", "portaudio-2.0.pc"]],
+    },
+    {
+        "name": "samplerate",
+        "version": "0.1.8",
+        "url": "http://www.mega-nerd.com/SRC/libsamplerate-0.1.8.tar.gz",
+        "file": "samplerate.tar.gz",
+        "sha512": "85d93df24d9d62e7803a5d0ac5d268b2085214adcb160e32fac316b1"
+                  "2ee8a0ce36ccfb433a3c0a08f6e3ec418a5962bdb84f8a11262286a9"
+                  "b347436983029a7d",
+        # fftw and sndfile are only used in example bins
+        "configure": ["--prefix={prefix}", "--disable-fftw",
+                      "--disable-sndfile"] + STD_CONFIGURE,
+        "make": [[], ["install"]],
+        "remove": ["bin", "share"],
+        "pkgconfig": [["samplerate.pc", "samplerate.pc"]],
+    },
+    {
+        "name": "sndfile",
+        "version": "1.0.25",
+        "url": "http://www.mega-nerd.com/libsndfile/files/"
+               "libsndfile-1.0.25.tar.gz",
+        "file": "sndfile.tar.gz",
+        "sha512": "4ca9780ed0a915aca8a10ef91bf4bf48b05ecb85285c2c3fe7eef1d4"
+                  "6d3e0747e61416b6bddbef369bd69adf4b796ff5f61380e0bc998906"
+                  "b170a93341ba6f78",
+        "configure": ["--prefix={prefix}", "--disable-external-libs",
+                      "--disable-sqlite"] + STD_CONFIGURE,
+        "make": [[], ["install"]],
+        "remove": ["bin", "share"],
+        "pkgconfig": [["sndfile.pc", "sndfile.pc"]],
+    },
+    {
+        "name": "xmlrpc",
+        "version": "1.16.42",
+        "url": "http://downloads.sourceforge.net/xmlrpc-c/"
+               "xmlrpc-c-1.16.42.tgz",
+        "file": "xmlrpc-c.tar.gz",
+        "sha512": "e7307631e6d2915eba7811570b8cb236994b82221458657347acf870"
+                  "3d9bf3c15e9d46c15a90c3cce0af81237286d9efbe5ee471881e1fc2"
+                  "a2a952beb1fdafb0",
+        "patches": ["mingw-xmlrpc-c.patch"],
+        "commands": [["autoconf"]],
+        "configure": ["--prefix={prefix}", "CC={mingw}-gcc",
+                      "--disable-wininet-client", "--disable-curl-client",
+                      "--disable-libwww-client"] + STD_CONFIGURE,
+        "make": [["BUILDTOOL_CC=gcc", "BUILDTOOL_CCLD=gcc",
+                  "CFLAGS_PERSONAL=-U_UNIX",
+                  "AR={mingw}-ar", "RANLIB={mingw}-ranlib"],
+                 ["install", "AR={mingw}-ar", "RANLIB={mingw}-ranlib"]],
+    },
+    {
+        "name": "libtool",
+        "version": "2.4.2",
+        "url": "http://ftpmirror.gnu.org/libtool/libtool-2.4.2.tar.gz",
+        "file": "libtool.tar.gz",
+        "sha512": "0e54af7bbec376f943f2b8e4f13631fe5627b099a37a5f0252e12bad"
+                  "e76473b0a36a673529d594778064cd8632abdc43d8a20883d66d6b27"
+                  "738861afbb7e211d",
+        "configure": ["--prefix={prefix}"] + STD_CONFIGURE,
+        "make": [[], ["install"]],
+    },
+    {
+        "name": "libusb",
+        "version": "1.2.6.0",
+        "url": "http://downloads.sourceforge.net/libusb-win32/"
+               "libusb-win32-src-1.2.6.0.zip",
+        "file": "libusb.zip",
+        "sha512": "972438b7465a22882bc91a1238291240ee3cdb09f374454a027d003b"
+                  "150656d4c262553104f74418bb49b4a7ca2f1a4f72d20e689fa3a772"
+                  "8881bafc876267f4",
+        "patches": ["libusb.patch"],
+        "make": [["host_prefix={mingw}", "dll"]],
+        "mkdirs": ["include", "lib", "lib/pkgconfig"],
+        "hook": "libusb_install",
+        "tools": ["{mingw}-ar", "{mingw}-ranlib"],
+        "files": ["libusb.pc"],
+        "pkgconfig": [["libusb.pc", "libusb.pc"]],
+    },
+    {
+        "name": "hamlib",
+        "version": "1.2.14",
+        "url": "http://downloads.sourceforge.net/hamlib/hamlib-1.2.14.tar.gz",
+        "file": "hamlib.tar.gz",
+        "sha512": "a209048750e7e55a2386af436e01741ffab0338aa21db8d1a82eb007"
+                  "2a5161e29c722c5cc1ea5d021dac9a069f7c4fe3a41c73969a6d39cd"
+                  "ee88f809c1ea4354",
+        "depends": ["pthreadsw32", "libtool", "libusb"],
+        "env": {"PKG_CONFIG_LIBDIR": "{build}/pkgconfig"},
+        "configure": ["--prefix={prefix}",
+                      "--without-rigmatrix", "--without-rpc-backends",
+                      "--without-winradio", "--without-gnuradio",
+                      "--without-usrp", "--without-cxx-binding",
+                      "--without-perl-binding", "--without-tcl-binding",
+                      "--without-python-binding"] + STD_CONFIGURE,
+        "flag_items": ["pthreadsw32", "libtool", "libusb"],
+        # Ugh... (and int != long for usleep)
+        "post_configure": [["sed", "-i", "s/ tests doc$/ doc/", "Makefile"],
+                           ["sed", "-i", "s/^int usleep/\\/\\//",
+                            "lib/win32termios.h"],
+                           ["mkdir", "libltdl"]],
+        "make": [["DEFS=-DHAVE_SLEEP -DHAVE_CONFIG_H"], ["install"]],
+        "hook": "hamlib_fix_pc",
+        "pkgconfig": [["hamlib.pc", "hamlib.pc"]],
+    },
+    {
+        "name": "openssl",
+        "version": "1.0.1c",
+        "url": "http://www.openssl.org/source/openssl-1.0.1c.tar.gz",
+        "file": "openssl.tar.gz",
+        "sha512": "14f766daab0828a2f07c65d6da8469a4a5a2b839ff3da188538c4e2d"
+                  "b3e3e2f37217fb37e269617fb438463b75fb77dab0b155f36831ff48"
+                  "edbc9e7f2903ebd3",
+        "commands": [["/bin/bash", "./Configure", "mingw",
+                      "--prefix={prefix}", "{cflags}"]],
+        "make": [["CC={mingw}-gcc", "AR={mingw}-ar r",
+                  "RANLIB={mingw}-ranlib", "DIRS=crypto ssl engines", "all"],
+                 ["DIRS=crypto ssl engines", "install_sw"]],
+        "pkgconfig": [["openssl.pc", "openssl.pc"],
+                      ["libssl.pc", "libssl.pc"],
+                      ["libcrypto.pc", "libcrypto.pc"]],
+    },
+    {
+        "name": "curl",
+        "version": "7.27.0",
+        "url": "http://curl.haxx.se/download/curl-7.27.0.tar.gz",
+        "file": "curl.tar.gz",
+        "sha512": "d701631e897464d92582a77f13e8aed17f10ee1d284007af3c1435a6"
+                  "c2263c90b4ba0334b9b41b20e34518d5d5be7cf0fd7c1ef0092bc592"
+                  "bd137577f5faf213",
+        "depends": ["zlib", "openssl"],
+        "configure": ["--prefix={prefix}", "--with-zlib={items}/zlib",
+                      "--with-ssl={items}/openssl", "--without-ldap-lib",
+                      "--disable-manual"] + STD_CONFIGURE,
+        "make": [[], ["install"]],
+        "remove": ["share"],
+        "pkgconfig": [["libcurl.pc", "libcurl.pc"]],
+    },
+    {
+        "name": "mingw_fakepath",
+        "version": "1",
+        "hook": "mingw_fakepath",
+        "tools": ["{mingw}-" + n for n in FAKEPATH_TOOLS],
+    },
+    {
+        "name": "dl_fldigi",
+        "version": None,
+        "depends": ["pthreadsw32", "zlib", "libpng", "libjpeg", "fltk",
+                    "directx_devel", "portaudio", "samplerate", "sndfile",
+                    "xmlrpc", "libtool", "libusb", "hamlib", "openssl",
+                    "curl", "mingw_fakepath"],
+        "hook": "dl_fldigi",
+        "tools": ["git", "autoreconf", "makensis", "{mingw}-g++",
+                  "{mingw}-objcopy", "{mingw}-strip", "{mingw}-nm"],
+    },
+]
 
 class Builder:
+    def __init__(self, recipes=RECIPES):
+        self.recipes = recipes
+        self.stats = dict.fromkeys(["tarball_hits", "tarball_misses",
+                                    "bytes_downloaded", "items_up_to_date",
+                                    "items_built", "remote_hits",
+                                    "remote_misses"], 0)
+        self.metrics = metrics.Metrics("mingw")
+        self.autotools_cache = None
+        self.watcher = None
+
     def main(self):
         logging.basicConfig(level=logging.INFO,
                 format="[%(asctime)s] %(message)s")
         self.get_options()
 
+        if self.options["list_recipes"]:
+            json.dump(self.build_order(), sys.stdout, indent=4)
+            sys.stdout.write("\n")
+            return
+
         if self.options["verbose"]:
             logging.getLogger().setLevel(level=logging.DEBUG)
         elif self.options["quiet"]:
             logging.getLogger().setLevel(level=logging.WARNING)
 
         try:
-            self.null = open("/dev/null", "w")
-            self.check_distro()
-            self.check_packages()
-            self.open_build_dir()
-            self.open_cache_dir()
-            self.find_extra_dir()
+            with self.metrics.phase("setup"):
+                self.check_distro()
+                self.open_build_dir()
+                self.open_cache_dir()
+                self.find_extra_dir()
+                if self.options["preflight"]:
+                    self.preflight()
+                if self.options["configure_cache"]:
+                    self.open_autoconf_cache()
+                if self.options["autotools_cache"]:
+                    self.autotools_cache = autotools_cache.AutotoolsCache(
+                            self.cloc("autotools"))
         except:
             logger.exception("Error whilst setting up")
+            self.write_metrics(False)
             sys.exit(1)
 
         delay_error = False
 
         try:
-            self.build_all()
+            if self.options["watch"]:
+                self.watch()
+            else:
+                self.build_all()
         except:
             logger.exception("Error in build")
             delay_error = True
@@ -59,6 +404,9 @@ class Builder:
             logger.exception("Error whilst cleaning up")
             delay_error = True
 
+        if not self.options["watch"]:
+            self.write_metrics(not delay_error)
+
         if delay_error:
             sys.exit(1)
         else:
@@ -80,15 +428,114 @@ class Builder:
                 help="enable DEBUG info", action="store_true")
         parser.add_option("-j", "--make-jobs", dest="make_jobs",
                 help="pass -j to make for speedy builds")
+        parser.add_option("--log-lines", dest="log_lines", type="int",
+                help="show this many lines of a failed command's output "
+                     "(full logs are kept in DIR/logs)", default=40)
         parser.add_option("-b", "--debug", dest="clean_temp_error_exit",
                 help="don't clean up if an error occurs, to allow debugging",
                 action="store_false", default=True)
+        parser.add_option("--configure-cache", dest="configure_cache",
+                help="share ./configure results between items and builds "
+                     "(kept in the cache directory, per toolchain)",
+                action="store_true")
+        parser.add_option("--autotools-cache", dest="autotools_cache",
+                help="restore autoconf/autoreconf outputs from the cache "
+                     "directory when configure.ac, *.am and *.m4 are "
+                     "unchanged (unsafe if configure.ac reads other files)",
+                action="store_true")
+        parser.add_option("--no-preflight", dest="preflight",
+                help="skip checking tools, files and patches before building",
+                action="store_false", default=True)
+        parser.add_option("-p", "--profile", dest="profile",
+                help="optimisation profile for every item: " +
+                     ", ".join(profiles.names()),
+                type="choice", choices=profiles.names(), default="default")
+        parser.add_option("-C", "--config", dest="configs", action="append",
+                help="build dl-fldigi in this configuration (repeatable); "
+                     "PROFILE applies to dl-fldigi only, and ARGS is a "
+                     "comma separated list of extra ./configure arguments",
+                metavar="NAME[:PROFILE[:ARGS]]")
+        parser.add_option("--target-cpu", dest="target_cpu", metavar="CPU",
+                help="-march for every item, instead of the profile's")
+        parser.add_option("--lto", dest="lto", action="store_true",
+                help="enable link time optimisation (needs a toolchain "
+                     "that supports it)")
+        parser.add_option("--analyse", dest="analyse", metavar="FILE",
+                help="work out which dependency features dl-fldigi uses, "
+                     "and write a profile for --trim-profile to FILE")
+        parser.add_option("--trim-profile", dest="trim_profile",
+                help="build the dependencies without the features that "
+                     "--analyse found unused, and check that dl-fldigi "
+                     "still gets every symbol it needs", metavar="FILE")
+        parser.add_option("--shrink", dest="shrink", action="store_true",
+                help="garbage collect unused sections, move dl-fldigi's "
+                     "debug info to a separate archive, and report how "
+                     "much each library adds to its size")
         parser.add_option("-o", "--output", dest="output",
                 help="save the dl-fldigi installer here", default=".")
+        parser.add_option("-l", "--list-recipes", dest="list_recipes",
+                help="print the recipes in build order and exit",
+                action="store_true")
+        parser.add_option("-r", "--remote-cache", dest="remote_cache",
+                help="fetch and share built items with the cache_server.py "
+                     "at this URL", metavar="URL")
+        parser.add_option("-w", "--watch", dest="watch",
+                help="keep running, building each new commit of git-commit "
+                     "(a branch; default HEAD)", action="store_true")
+        parser.add_option("--poll-interval", dest="poll_interval", type="int",
+                help="seconds between polls in --watch mode", default=60)
+        parser.add_option("--settle", dest="settle", type="int",
+                help="wait until no new commits have arrived for this many "
+                     "seconds before building", default=30)
+        parser.add_option("--status-file", dest="status_file",
+                help="where --watch writes its queue and status "
+                     "(default: status.json in the build directory)")
+        parser.add_option("--metrics", dest="metrics", metavar="FILE",
+                help="write timings and cache statistics here, for "
+                     "node_exporter's textfile collector (name it *.prom)")
 
         (options, args) = parser.parse_args()
         self.options = options.__dict__
 
+        self.profile_flags = profiles.flags(self.options["profile"],
+                                            self.options["target_cpu"],
+                                            self.options["lto"],
+                                            gc_sections=self.options["shrink"])
+        self.profile_env = self.flags_env(self.profile_flags)
+
+        self.configs = []
+        for c in self.options["configs"] or []:
+            parts = c.split(":", 2)
+            if not re.match(r"^[a-zA-Z0-9_\-]+$", parts[0]):
+                parser.error("Bad configuration name " + repr(parts[0]))
+            if len(parts) > 1 and parts[1] not in profiles.names():
+                parser.error("Unknown profile " + repr(parts[1]))
+            self.configs.append({
+                "name": parts[0],
+                "profile": parts[1] if len(parts) > 1 else
+                           self.options["profile"],
+                "args": parts[2].split(",") if len(parts) > 2 else []})
+
+        if self.options["analyse"] and self.configs:
+            parser.error("--analyse works on a single configuration")
+
+        remote = self.options["remote_cache"]
+        if remote and urlparse.urlsplit(remote).scheme not in \
+                ("http", "https"):
+            parser.error("--remote-cache needs an http:// or https:// URL")
+
+        self.trim = None
+        if self.options["trim_profile"]:
+            try:
+                with open(self.options["trim_profile"]) as f:
+                    self.trim = json.load(f)
+            except (IOError, ValueError) as e:
+                parser.error("Could not load trim profile: " + str(e))
+            self.recipes = trim.apply(self.recipes, self.trim)
+
+        if self.options["list_recipes"]:
+            return
+
         if len(args) != 1 and len(args) != 2:
             parser.error("Expected single argument: dl-fldigi git location")
         if len(args) == 1:
@@ -97,14 +544,102 @@ class Builder:
         self.dl_fldigi_source = args[0]
         self.dl_fldigi_commit = args[1]
 
-    def check_packages(self):
-        for b in [MINGW_NAME + "-gcc", "makensis", "autoconf",
-                  "autoreconf", "git"]:
-            self.find_path(b)
+    def preflight(self):
+        tools = set([MINGW_NAME + "-gcc", "make", "tar"])
+        files = set()
+        checks = [self.check_nsis]
+
+        for recipe in self.build_order():
+            commands = recipe.get("commands", []) + \
+                       recipe.get("post_configure", [])
+            for c in self.recipe_args(recipe, [c[0] for c in commands]):
+                if not c.startswith("./"):
+                    tools.add(c)
+            tools.update(self.recipe_args(recipe, recipe.get("tools", [])))
+
+            if recipe.get("file", "").endswith(".zip"):
+                tools.add("unzip")
+            if recipe.get("patches"):
+                tools.add("patch")
+                checks.append(lambda r=recipe: self.check_patches(r))
+
+            files.update(recipe.get("patches", []))
+            files.update(source for source, dest
+                         in recipe.get("extra_files", []))
+            files.update(recipe.get("files", []))
+
+        checks += [lambda t=t: preflight.check_executable(paths.find_path, t)
+                   for t in sorted(tools)]
+        checks += [lambda f=f: self.check_extra_file(f)
+                   for f in sorted(files)]
+
+        preflight.run(checks)
+
+    def check_extra_file(self, name):
+        if not os.path.isfile(self.eloc(name)):
+            return ["Missing " + self.eloc(name)]
+        return []
+
+    def check_nsis(self):
+        (ret, out) = preflight.command_output(("makensis", "-VERSION"))
+        if ret != 0:
+            return ["makensis does not run: " + out]
+        if not os.path.isdir(NSIS_PLUGIN_DIR) or \
+                not os.listdir(NSIS_PLUGIN_DIR):
+            return ["No NSIS plugins found in " + NSIS_PLUGIN_DIR]
+        return []
+
+    def check_patches(self, recipe):
+        # Tarballs that aren't cached yet are checked when downloaded.
+        fn = self.cloc(recipe["file"])
+        if not os.path.exists(fn):
+            return []
+
+        with open(fn, "rb") as f:
+            if not self.check_hash(f, recipe["sha512"]):
+                logger.warning("Cached " + recipe["file"] + " has a bad "
+                               "hash and will be downloaded again")
+                return []
+
+        problems = []
+        d = tempfile.mkdtemp(prefix="preflight-", dir=self.location)
+
+        try:
+            if fn.endswith(".zip"):
+                (ret, out) = preflight.command_output(
+                        ("unzip", "-q", fn), cwd=d)
+            else:
+                (ret, out) = preflight.command_output(
+                        ("tar", "-xf", fn, "--strip-components=1"), cwd=d)
+            if ret != 0:
+                return ["Couldn't extract " + recipe["file"] + ": " + out]
+            if not os.listdir(d):
+                return ["Couldn't extract " + recipe["file"] + ": it is "
+                        "empty"]
+
+            # Zips keep their top level directory
+            src = d
+            if fn.endswith(".zip"):
+                src = os.path.join(d, os.listdir(d)[0])
+
+            for p in recipe["patches"]:
+                if not os.path.isfile(self.eloc(p)):
+                    continue # reported by check_extra_file
+                with open(self.eloc(p)) as f:
+                    (ret, out) = preflight.command_output(
+                            ("patch", "-p1", "--dry-run", "-f", "-s"),
+                            stdin=f, cwd=src)
+                if ret != 0:
+                    problems.append(p + " does not apply cleanly to " +
+                                    recipe["file"] + ": " + out)
+        finally:
+            shutil.rmtree(d)
+
+        return problems
 
     def check_distro(self):
         try:
-            self.find_path("lsb_release")
+            paths.find_path("lsb_release")
         except:
             logger.warning("Unable to determine linux distro.")
             logger.warning("This script has been tested on Ubuntu lucid "
@@ -127,27 +662,10 @@ class Builder:
             logger.warning("This script has been tested on Ubuntu lucid "
                            "and Debian squeeze only!")
 
-    def find_path(self, name):
-        for d in os.environ["PATH"].split(":"):
-            path = os.path.realpath(os.path.join(d, name))
-            if os.path.exists(path):
-                return path
-        raise Exception("Could not find " + name + " in the path")
-
     def open_cache_dir(self):
         self.cache = os.path.realpath(self.options["cache"])
         logger.debug("Cache directory is " + self.cache)
-
-        try:
-            mode = os.stat(self.cache).st_mode
-        except OSError as e:
-            if e.errno != errno.ENOENT:
-                raise
-
-            os.mkdir(self.cache)
-        else:
-            if not stat.S_ISDIR(mode):
-                raise Exception(self.cache + " is not a directory")
+        paths.open_dir(self.cache)
 
     def open_build_dir(self):
         self.location = os.path.realpath(self.options["directory"])
@@ -157,21 +675,13 @@ class Builder:
             raise Exception("Some build scripts don't like non a-zA-Z0-9_- in "
                             "the path to the build directory; sorry :-(")
 
-        new_state = False
-
-        try:
-            mode = os.stat(self.location).st_mode
-        except OSError as e:
-            if e.errno != errno.ENOENT:
-                raise
-
-            os.mkdir(self.loc())
+        new_state = paths.open_dir(self.location)
+        if new_state:
             os.mkdir(self.loc("pkgconfig"))
             os.mkdir(self.loc("items"))
-            new_state = True
-        else:
-            if not stat.S_ISDIR(mode):
-                raise Exception(self.location + " is not a directory")
+
+        if not os.path.isdir(self.loc("logs")):
+            os.mkdir(self.loc("logs"))
 
         self.state_file = open(self.loc("state.json"), "a+")
         fcntl.flock(self.state_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
@@ -227,58 +737,355 @@ class Builder:
         self.write_state()
         fcntl.flock(self.state_file, fcntl.LOCK_UN)
         self.state_file.close()
-        self.null.close()
         if self.options["clean_temp_error_exit"]:
             self.clean_temp()
 
+    def build_order(self):
+        by_name = dict((r["name"], r) for r in self.recipes)
+        order = []
+        stack = []
+
+        def visit(name):
+            if name in order:
+                return
+            if name in stack:
+                raise Exception("Dependency cycle: " +
+                                " -> ".join(stack + [name]))
+            if name not in by_name:
+                raise Exception("Unknown item " + name)
+
+            stack.append(name)
+            for d in by_name[name].get("depends", []):
+                visit(d)
+            stack.pop()
+            order.append(name)
+
+        for r in self.recipes:
+            visit(r["name"])
+
+        return [by_name[n] for n in order]
+
     def build_all(self):
-        self.item("pthreadsw32", "2.8.0")
-        self.item("zlib", "1.2.7")
-        self.item("libpng", "1.5.12")
-        self.item("libjpeg", "6b")
-        self.item("fltk", "1.3.0")
-        self.item("directx_devel", "3")
-        self.item("portaudio", "v19_20111121")
-        self.item("samplerate", "0.1.8")
-        self.item("sndfile", "1.0.25")
-        self.item("xmlrpc", "1.16.42")
-        self.item("libtool", "2.4.2")
-        self.item("libusb", "1.2.6.0")
-        self.item("hamlib", "1.2.14")
-        self.item("openssl", "1.0.1c")
-        self.item("curl", "7.27.0")
-        self.item("mingw_fakepath", "1")
-        self.item("dl_fldigi", None)
-
-    def item(self, name, version):
+        self.fingerprints = {}
+        with self.metrics.phase("items"):
+            for recipe in self.build_order():
+                self.item(recipe)
+
+    def watch(self):
+        status_file = self.options["status_file"] or self.loc("status.json")
+        w = watcher.Watcher(self.dl_fldigi_source, self.dl_fldigi_commit,
+                            self.cloc("dl-fldigi.git"), status_file,
+                            self.options["poll_interval"],
+                            self.options["settle"])
+
+        # Builds clone from the local mirror, which Watcher keeps fetched.
+        self.dl_fldigi_source = w.mirror
+        self.watcher = w
+        w.run(self.build_commit)
+
+    def build_commit(self, commit):
+        self.dl_fldigi_commit = commit
+        self.metrics.start_build()
+        try:
+            self.build_all()
+        except:
+            self.write_metrics(False)
+            raise
+        self.write_metrics(True)
+        return True
+
+    def write_metrics(self, success):
+        if not self.options["metrics"]:
+            return
+
+        m = self.metrics
+        m.cache("tarball", self.stats["tarball_hits"],
+                self.stats["tarball_misses"])
+        m.cache("item", self.stats["items_up_to_date"],
+                self.stats["items_built"] + self.stats["remote_hits"])
+        if self.options["remote_cache"]:
+            m.cache("remote", self.stats["remote_hits"],
+                    self.stats["remote_misses"])
+        if self.autotools_cache:
+            m.cache("autotools", self.autotools_cache.hits,
+                    self.autotools_cache.misses)
+        if self.watcher:
+            m.cache("mirror", self.watcher.mirror_hits,
+                    self.watcher.mirror_misses)
+        m.set("downloaded_bytes_total", self.stats["bytes_downloaded"],
+              "Bytes of source tarballs downloaded", "counter")
+
+        try:
+            m.write(self.options["metrics"], success)
+        except:
+            logger.exception("Error writing metrics")
+
+    def fingerprint(self, recipe):
+        # Items without a version (dl-fldigi) are always rebuilt, and so is
+        # anything that depends on them.
+        if not recipe["version"]:
+            return None
+
+        h = hashlib.sha1()
+        h.update(json.dumps([RECIPE_FORMAT, self.location, MINGW_NAME,
+                             self.options["profile"], self.profile_flags,
+                             recipe], sort_keys=True))
+
+        # The recipe only names its w32_extra files; editing one (a patch,
+        # say) must change the fingerprint too.
+        extra = list(recipe.get("patches", [])) + \
+                [src for (src, dest) in recipe.get("extra_files", [])] + \
+                list(recipe.get("files", []))
+        for fn in extra:
+            try:
+                with open(self.eloc(fn), "rb") as f:
+                    h.update(fn + "\0" + hashlib.sha1(f.read()).digest())
+            except IOError:
+                h.update(fn + "\0missing") # reported when it is used
+
+        for d in recipe.get("depends", []):
+            if not self.fingerprints[d]:
+                return None
+            h.update(self.fingerprints[d])
+        return h.hexdigest()
+
+    def item(self, recipe):
+        name = recipe["name"]
+        version = recipe["version"]
+        fingerprint = self.fingerprint(recipe)
+        self.fingerprints[name] = fingerprint
+
         if name not in self.state:
             self.state[name] = False
 
-        if version and self.state[name] == version \
+        if fingerprint and self.state[name] == fingerprint \
                 and not self.options["remake_all"]:
             logger.debug(name + " already built")
+            self.stats["items_up_to_date"] += 1
             return
 
         if not version:
             version = "latest"
 
+        self.capture = capture.Capture(self.loc("logs", name + ".log.gz"),
+                                       self.options["log_lines"],
+                                       self.options["verbose"])
+        try:
+            with self.metrics.timer("item_duration_seconds",
+                                    "Time taken to build or fetch each item",
+                                    item=name):
+                self.make_item(recipe, version, fingerprint)
+        finally:
+            self.capture.close()
+
+        self.state[name] = fingerprint or version
+        self.write_state()
+
+    def make_item(self, recipe, version, fingerprint):
+        name = recipe["name"]
+
         self.clean_temp()
         self.clean_dir("items", name)
 
+        if fingerprint and self.options["remote_cache"] \
+                and not self.options["remake_all"]:
+            if self.remote_fetch(recipe, fingerprint):
+                self.stats["remote_hits"] += 1
+                self.clean_temp()
+                return
+            self.stats["remote_misses"] += 1
+
         logger.info("Building " + name + " " + version)
 
         try:
-            getattr(self, name)()
+            self.build_recipe(recipe)
         except:
             self.clean_dir("items", name)
             raise
-        else:
-            self.clean_temp()
+
+        self.stats["items_built"] += 1
+
+        if fingerprint and self.options["remote_cache"]:
+            self.remote_store(recipe, fingerprint)
+
+        self.clean_temp()
 
         logger.debug(name + " done")
 
-        self.state[name] = version
-        self.write_state()
+    def remote_url(self, fingerprint):
+        return self.options["remote_cache"].rstrip("/") + "/" + \
+                fingerprint + ".tar.gz"
+
+    def remote_fetch(self, recipe, fingerprint):
+        name = recipe["name"]
+        fn = self.loc("temp", "remote.tar.gz")
+
+        try:
+            s = urllib2.urlopen(self.remote_url(fingerprint),
+                                timeout=REMOTE_TIMEOUT)
+            try:
+                with open(fn, "wb") as f:
+                    shutil.copyfileobj(s, f)
+            finally:
+                s.close()
+        except urllib2.HTTPError as e:
+            if e.code != 404:
+                logger.warning("Remote cache error for " + name + ": " +
+                               str(e))
+            return False
+        except (IOError, httplib.HTTPException) as e:
+            logger.warning("Remote cache unavailable: " + str(e))
+            return False
+
+        try:
+            self.src_cmd("tar", "-xzf", fn, cwd=self.loc("items", name))
+        except:
+            logger.warning("Bad archive for " + name + " in remote cache")
+            self.clean_dir("items", name)
+            return False
+
+        self.link_pkgconfig(recipe)
+        logger.info("Fetched " + name + " from remote cache")
+        return True
+
+    def remote_store(self, recipe, fingerprint):
+        name = recipe["name"]
+        fn = self.loc("temp", "remote.tar.gz")
+        url = urlparse.urlsplit(self.remote_url(fingerprint))
+
+        try:
+            self.src_cmd("tar", "-czf", fn, ".", cwd=self.loc("items", name))
+        except:
+            # The item built fine; only sharing it failed
+            logger.warning("Could not archive " + name + " for the remote "
+                           "cache", exc_info=True)
+            return
+
+        try:
+            if url.scheme == "https":
+                conn = httplib.HTTPSConnection(url.netloc,
+                                               timeout=REMOTE_TIMEOUT)
+            else:
+                conn = httplib.HTTPConnection(url.netloc,
+                                              timeout=REMOTE_TIMEOUT)
+            with open(fn, "rb") as f:
+                conn.request("PUT", url.path, f,
+                             {"Content-Length": str(os.path.getsize(fn)),
+                              "Content-Type": "application/gzip"})
+            response = conn.getresponse()
+            response.read()
+            conn.close()
+        except (IOError, httplib.HTTPException) as e:
+            logger.warning("Remote cache unavailable: " + str(e))
+            return
+
+        if response.status not in (200, 201, 204):
+            logger.warning("Remote cache refused " + name + ": " +
+                           str(response.status) + " " + response.reason)
+        else:
+            logger.debug("Uploaded " + name + " to remote cache")
+
+    def recipe_vars(self, recipe):
+        return {"prefix": self.loc("items", recipe["name"]),
+                "items": self.loc("items"),
+                "build": self.location,
+                "mingw": MINGW_NAME}
+
+    def recipe_args(self, recipe, args):
+        v = self.recipe_vars(recipe)
+        result = []
+        for a in args:
+            # For build systems that take compiler flags as arguments
+            if a == "{cflags}":
+                result += self.profile_flags["CFLAGS"]
+            else:
+                result.append(a.format(**v))
+        return result
+
+    def flags_env(self, flags):
+        return dict((var, " ".join(value)) for (var, value)
+                    in flags.items() if value)
+
+    def recipe_env(self, recipe):
+        if "env" not in recipe and not self.profile_env:
+            return None
+
+        v = self.recipe_vars(recipe)
+        env = os.environ.copy()
+        env.update(self.profile_env)
+        for var, value in recipe.get("env", {}).items():
+            # The profile's flags replace an item's own (zlib's -O2)
+            if var not in self.profile_env:
+                env[var] = value.format(**v)
+        return env
+
+    def build_recipe(self, recipe):
+        name = recipe["name"]
+        env = self.recipe_env(recipe)
+
+        def prefix(*args):
+            return self.loc("items", name, *args)
+
+        if "file" in recipe:
+            with self.metrics.timer("download_duration_seconds",
+                                    "Time taken to fetch and check each "
+                                    "item's source", item=name):
+                self.download_source(recipe["url"], recipe["file"],
+                                     recipe["sha512"])
+            if recipe["file"].endswith(".zip"):
+                self.extract_source_zip(recipe["file"])
+            else:
+                self.extract_source_tar(recipe["file"])
+
+        for p in recipe.get("patches", []):
+            with open(self.eloc(p)) as f:
+                self.src_cmd("patch", "-p1", stdin=f)
+
+        for c in recipe.get("commands", []):
+            c = self.recipe_args(recipe, c)
+            if c[0] in ("autoconf", "autoreconf"):
+                self.autotools(*c)
+            else:
+                self.src_cmd(*c, env=env)
+
+        if "configure" in recipe:
+            kwargs = {"env": env}
+            cache = recipe.get("configure_cache", "shared")
+            if cache == "private":
+                kwargs["cache"] = name
+            elif cache:
+                kwargs["cache"] = "shared"
+            if "flag_items" in recipe:
+                kwargs["flag_items"] = recipe["flag_items"]
+            self.configure(*self.recipe_args(recipe, recipe["configure"]),
+                           **kwargs)
+
+        for c in recipe.get("post_configure", []):
+            self.src_cmd(*self.recipe_args(recipe, c), env=env)
+
+        for d in recipe.get("mkdirs", []):
+            os.mkdir(prefix(d))
+
+        for source, dest in recipe.get("extra_files", []):
+            shutil.copy(self.eloc(source), prefix(dest))
+
+        for m in recipe.get("make", []):
+            self.make(*self.recipe_args(recipe, m), env=env)
+
+        if "hook" in recipe:
+            getattr(self, recipe["hook"])(recipe)
+
+        for d in recipe.get("remove", []):
+            shutil.rmtree(prefix(d))
+
+        for target, link in recipe.get("symlinks", []):
+            os.symlink(prefix(target), prefix(link))
+
+        self.link_pkgconfig(recipe)
+
+    def link_pkgconfig(self, recipe):
+        for pcname, source in recipe.get("pkgconfig", []):
+            self.copy_pkgconfig(recipe["name"], pcname, source)
 
     def check_hash(self, f, expect):
         h = self.file_sha512(f)
@@ -310,8 +1117,11 @@ class Builder:
                 logger.info("Hash for " + name + " is bad, redownloading")
             else:
                 logger.debug("Using cached " + name)
+                self.stats["tarball_hits"] += 1
                 return f
 
+            self.stats["tarball_misses"] += 1
+
             fcntl.flock(f, fcntl.LOCK_EX)
 
             f.truncate(0)
@@ -321,6 +1131,7 @@ class Builder:
             d = s.read(1024)
             while len(d):
                 f.write(d)
+                self.stats["bytes_downloaded"] += len(d)
                 d = s.read(1024)
 
             if not self.check_hash(f, fhash):
@@ -373,18 +1184,30 @@ class Builder:
     def src_cmd(self, *args, **kwargs):
         logger.debug("Executing: " + repr(args) + " " + repr(kwargs))
 
-        if not self.options["verbose"]:
-            kwargs["stdout"] = self.null
-            kwargs["stderr"] = self.null
-
         if "cwd" not in kwargs:
             kwargs["cwd"] = self.loc("temp", "src")
 
-        ret = subprocess.call(args, **kwargs)
+        # Concurrent dl-fldigi configurations each have their own log
+        log = kwargs.pop("capture", self.capture)
+        ret = log.call(args, **kwargs)
 
         if ret != 0:
+            log.show_tail()
             raise Exception("subprocess error exited " + repr(args))
 
+    def src_cmd_output(self, *args, **kwargs):
+        with tempfile.TemporaryFile() as f:
+            self.src_cmd(*args, stdout=f, **kwargs)
+            f.seek(0)
+            return f.read()
+
+    def autotools(self, *args):
+        if self.autotools_cache:
+            self.autotools_cache.run(self.loc("temp", "src"), args,
+                                     self.src_cmd)
+        else:
+            self.src_cmd(*args)
+
     def make(self, *args, **kwargs):
         args = list(args)
         args.insert(0, "make")
@@ -394,11 +1217,14 @@ class Builder:
 
     def configure(self, *args, **kwargs):
         args = list(args)
-        args.insert(0, "./configure")
+        args.insert(0, kwargs.pop("script", "./configure"))
 
         if "flag_items" in kwargs:
+            # These arguments override the environment, which may hold the
+            # profile's LDFLAGS.
             CPPFLAGS = []
-            LDFLAGS = []
+            env = kwargs.get("env") or os.environ
+            LDFLAGS = [env.get("LDFLAGS", "")]
 
             for i in kwargs["flag_items"]:
                 CPPFLAGS.append(" -I" + self.loc("items", i, "include"))
@@ -409,19 +1235,91 @@ class Builder:
             args.append("CPPFLAGS=" + " ".join(CPPFLAGS))
             args.append("LDFLAGS=" + " ".join(LDFLAGS))
 
-        self.src_cmd(*args, **kwargs)
-
-    def pthreadsw32(self):
-        self.download_source("ftp://sourceware.org/pub/pthreads-win32/"
-            "pthreads-w32-2-8-0-release.tar.gz", "pthreadsw32.tar.gz",
-            "d86040b18641b52f2de81468e06e2885d0f0ed47cc5c9c90ca33614ed53ddd60"
-            "167723b46eb477d905ad69f93b6b9002762589ba6c351f78a8041109cdbf287e")
-        self.extract_source_tar("pthreadsw32.tar.gz")
-        self.make("CROSS=" + MINGW_NAME + "-", "clean", "GC-inlined")
+        cache = kwargs.pop("cache", None)
 
-        for d in ["include", "lib"]:
-            os.mkdir(self.loc("items", "pthreadsw32", d))
+        if not cache or not self.options["configure_cache"]:
+            self.src_cmd(*args, **kwargs)
+            return
 
+        cache_file = self.autoconf_cache_file(cache, args, kwargs.get("env"))
+
+        with open(cache_file + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            try:
+                self.src_cmd(*(args + ["--cache-file=" + cache_file]),
+                             **kwargs)
+            except:
+                log = kwargs.get("capture", self.capture)
+                if not self.cache_rejected(log):
+                    raise
+                logger.warning("configure rejected " + cache_file +
+                               "; discarding it and retrying")
+                self.rm_f(cache_file)
+                self.src_cmd(*args, **kwargs)
+
+    def cache_rejected(self, log):
+        """Did configure fail because of its cache file?
+
+        Other failures (a missing dependency, bad flags) would only fail
+        again without the cache, and discarding it would cost every other
+        item using it.
+        """
+
+        for line in log.ring:
+            if line.startswith("$ "):
+                continue
+            if any(e in line for e in CONFIGURE_CACHE_ERRORS):
+                return True
+        return False
+
+    def autoconf_cache_file(self, cache, args, env):
+        if cache == "shared":
+            # configure refuses a cache written with different precious
+            # variables, and its probes depend on them anyway, so only
+            # runs with identical compiler settings share a file.
+            if env is None:
+                env = os.environ
+            settings = [a for a in args if re.match(r"^[A-Z_]+=", a)]
+            settings += [v + "=" + env[v] for v in PRECIOUS_ENV if v in env]
+            h = hashlib.sha1(json.dumps(settings)).hexdigest()
+            cache = "shared-" + h[:16]
+
+        return os.path.join(self.autoconf_cache, cache + ".cache")
+
+    def open_autoconf_cache(self):
+        toolchain = self.toolchain_fingerprint()
+        logger.debug("Toolchain fingerprint is " + toolchain)
+
+        base = self.cloc("autoconf")
+        if not os.path.isdir(base):
+            os.mkdir(base)
+
+        # Caches made by a different toolchain are never valid again.
+        for d in os.listdir(base):
+            if d != toolchain:
+                logger.info("Removing stale configure cache " + d)
+                shutil.rmtree(os.path.join(base, d))
+
+        self.autoconf_cache = os.path.join(base, toolchain)
+        if not os.path.isdir(self.autoconf_cache):
+            os.mkdir(self.autoconf_cache)
+
+    def toolchain_fingerprint(self):
+        h = hashlib.sha1()
+
+        for t in ["gcc", "g++", "cpp", "as", "ld", "ar"]:
+            path = paths.find_path(MINGW_NAME + "-" + t)
+            s = os.stat(path)
+            h.update("{0} {1} {2}\n".format(path, s.st_size, s.st_mtime))
+
+        p = subprocess.Popen((MINGW_NAME + "-gcc", "-v"),
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        h.update(p.communicate()[0])
+
+        return h.hexdigest()
+
+    def pthreadsw32_install(self, recipe):
         for f in ["pthread.h", "sched.h", "semaphore.h"]:
             shutil.copy(self.loc("temp", "src", f),
                         self.loc("items", "pthreadsw32", "include"))
@@ -430,237 +1328,28 @@ class Builder:
                     self.loc("items", "pthreadsw32", "lib", "libpthreadGC2.a"))
         shutil.copy(self.loc("temp", "src", "pthreadGC2.dll"),
                     self.loc("items", "pthreadsw32", "lib", "pthreadGC2.dll"))
-        os.symlink(self.loc("items", "pthreadsw32", "lib", "libpthreadGC2.a"),
-                   self.loc("items", "pthreadsw32", "lib", "libpthread.a"))
-
-    def zlib(self):
-        self.download_source("http://zlib.net/zlib-1.2.7.tar.gz",
-            "zlib.tar.gz",
-            "b1c073ad26684e354f7c522c14655840592e03872bc0a94690f89cae2ff88f14"
-            "6fce1dad252ff27a889dac4a32ff9f8ab63ba940671f9da89e9ba3e19f1bf58d")
-        self.extract_source_tar("zlib.tar.gz")
 
-        env = os.environ.copy()
-        for var, binary in [("CC", "gcc"), ("AR", "ar"), ("RANLIB", "ranlib")]:
-            env[var] = MINGW_NAME + "-" + binary
-        env["CFLAGS"] = "-O2"
-
-        self.configure("--prefix=" + self.loc("items", "zlib"), env=env)
-        self.make("LDSHAREDLIBC=")
-        self.make("install")
-
-        # Remove docs
-        shutil.rmtree(self.loc("items", "zlib", "share"))
-
-    def libpng(self):
-        self.download_source("http://downloads.sourceforge.net/libpng/"
-            "libpng-1.5.12.tar.gz", "libpng.tar.gz",
-            "dbefad00fa34f4f21dca0f1e92e95bd55f1f4478fa0095dcf015b4d06f0c823f"
-            "f11755cd777e507efaf1c9098b74af18f613ec9000e5c3a5cc1c7554fb5aefb8")
-        self.extract_source_tar("libpng.tar.gz")
-
-        self.configure("--prefix=" + self.loc("items", "libpng"),
-                flag_items=["zlib"], *STD_CONFIGURE)
-        self.make()
-        self.make("install")
-
-        self.copy_pkgconfig("libpng", "libpng.pc")
-        os.symlink(self.loc("items", "libpng", "include", "libpng15"),
-                   self.loc("items", "libpng", "include", "libpng"))
-
-        shutil.rmtree(self.loc("items", "libpng", "share"))
-
-    def libjpeg(self):
-        self.download_source("http://downloads.sourceforge.net/libjpeg/"
-            "jpegsrc.v6b.tar.gz", "libjpeg6b.tar.gz",
-            "5d37d3695105fc345ca269ab98cd991472e5de72f702c9a8a652a7d114a40eb9"
-            "9670c69a87ecb24bf64e96318fc0ee2bcb44c497d9d3d2a67378c99e4eb348fe")
-        self.extract_source_tar("libjpeg6b.tar.gz")
-
-        self.configure("--prefix=" + self.loc("items", "libjpeg"),
-                "CC=" + MINGW_NAME + "-gcc")
-        self.make("libjpeg.a",
-                "AR=" + MINGW_NAME + "-ar rc",
-                "AR2=" + MINGW_NAME + "-ranlib")
-
-        for d in ["include", "lib"]:
-            os.mkdir(self.loc("items", "libjpeg", d))
-        self.make("install-lib")
-
-    def fltk(self):
-        self.download_source("http://ftp.easysw.com/pub/fltk/1.3.0/"
-            "fltk-1.3.0-source.tar.gz", "fltk.tar.gz",
-            "a7adf9def90b143bc7ff54ac82fe9f6812b49209ab4145aada45210a3c314f9d"
-            "91ae413240a8c57492826eca011aa147c68a131a9fe20bf221e7bc70c6c908ee")
-        self.extract_source_tar("fltk.tar.gz")
-        with open(self.eloc("mingw-fltk.patch")) as p:
-            self.src_cmd("patch", "-p1", stdin=p)
-
-        self.src_cmd("autoconf")
-        self.configure("--prefix=" + self.loc("items", "fltk"),
-                "--enable-threads", *STD_CONFIGURE,
-                flag_items=["libpng", "libjpeg", "zlib", "pthreadsw32"])
-        # DIRS=src switches off building in documentation, test, fluid
-        # directories.
-        self.make("DIRS=src")
-        self.make("DIRS=src", "install")
-
-        # fltk-config binary
-
-    def directx_devel(self):
-        os.mkdir(self.loc("items", "directx_devel", "include"))
-        shutil.copy(self.eloc("dsound.h"),
-                    self.loc("items", "directx_devel", "include"))
-
-    def portaudio(self):
-        self.download_source("http://www.portaudio.com/archives/"
-            "pa_stable_v19_20111121.tgz", "portaudio.tar.gz",
-            "e9d039313ce27ae1f643ef2509ddea7ac6aadca5d39f2f2a4f0ccd8a3661a5a5"
-            "6a29e666300d3d4418cab6231ee14b3c09eb83dca0dd3326e1f24418d035abb2")
-        self.extract_source_tar("portaudio.tar.gz")
-
-        self.configure("--prefix=" + self.loc("items", "portaudio"),
-                "--with-winapi=wmme,directx",
-                "--with-dxdir=" + self.loc("items", "directx_devel"),
-                *STD_CONFIGURE)
-        self.make()
-        self.make("install")
-
-        self.copy_pkgconfig("portaudio", "portaudio-2.0.pc")
-
-    def samplerate(self):
-        self.download_source("http://www.mega-nerd.com/SRC/"
-            "libsamplerate-0.1.8.tar.gz", "samplerate.tar.gz",
-            "85d93df24d9d62e7803a5d0ac5d268b2085214adcb160e32fac316b12ee8a0ce"
-            "36ccfb433a3c0a08f6e3ec418a5962bdb84f8a11262286a9b347436983029a7d")
-        self.extract_source_tar("samplerate.tar.gz")
-
-        self.configure("--prefix=" + self.loc("items", "samplerate"),
-                "--disable-fftw", "--disable-sndfile", # Used in example bins
-                *STD_CONFIGURE)
-        self.make()
-        self.make("install")
-
-        shutil.rmtree(self.loc("items", "samplerate", "bin"))
-        shutil.rmtree(self.loc("items", "samplerate", "share"))
-
-        self.copy_pkgconfig("samplerate", "samplerate.pc")
-
-    def sndfile(self):
-        self.download_source("http://www.mega-nerd.com/libsndfile/files/"
-            "libsndfile-1.0.25.tar.gz", "sndfile.tar.gz",
-            "4ca9780ed0a915aca8a10ef91bf4bf48b05ecb85285c2c3fe7eef1d46d3e0747"
-            "e61416b6bddbef369bd69adf4b796ff5f61380e0bc998906b170a93341ba6f78")
-        self.extract_source_tar("sndfile.tar.gz")
-
-        self.configure("--prefix=" + self.loc("items", "sndfile"),
-                "--disable-external-libs", "--disable-sqlite", *STD_CONFIGURE)
-        self.make()
-        self.make("install")
-
-        shutil.rmtree(self.loc("items", "sndfile", "bin"))
-        shutil.rmtree(self.loc("items", "sndfile", "share"))
-
-        self.copy_pkgconfig("sndfile", "sndfile.pc")
-
-    def xmlrpc(self):
-        self.download_source("http://downloads.sourceforge.net/xmlrpc-c/"
-            "xmlrpc-c-1.16.42.tgz", "xmlrpc-c.tar.gz",
-            "e7307631e6d2915eba7811570b8cb236994b82221458657347acf8703d9bf3c1"
-            "5e9d46c15a90c3cce0af81237286d9efbe5ee471881e1fc2a2a952beb1fdafb0")
-        self.extract_source_tar("xmlrpc-c.tar.gz")
-        with open(self.eloc("mingw-xmlrpc-c.patch")) as p:
-            self.src_cmd("patch", "-p1", stdin=p)
-
-        self.src_cmd("autoconf")
-        self.configure("--prefix=" + self.loc("items", "xmlrpc"),
-                "CC=" + MINGW_NAME + "-gcc",
-                "--disable-wininet-client", "--disable-curl-client",
-                "--disable-libwww-client", *STD_CONFIGURE)
-
-        arargs = ["AR=" + MINGW_NAME + "-ar",
-                  "RANLIB=" + MINGW_NAME + "-ranlib"]
-        self.make("BUILDTOOL_CC=gcc", "BUILDTOOL_CCLD=gcc",
-                  "CFLAGS_PERSONAL=-U_UNIX", *arargs)
-        self.make("install", *arargs)
-
-        # xmlrpc-c-config binary
-
-    def libtool(self):
-        self.download_source("http://ftpmirror.gnu.org/libtool/"
-            "libtool-2.4.2.tar.gz", "libtool.tar.gz",
-            "0e54af7bbec376f943f2b8e4f13631fe5627b099a37a5f0252e12bade76473b0"
-            "a36a673529d594778064cd8632abdc43d8a20883d66d6b27738861afbb7e211d")
-        self.extract_source_tar("libtool.tar.gz")
-
-        self.configure("--prefix=" + self.loc("items", "libtool"),
-                *STD_CONFIGURE)
-        self.make()
-        self.make("install")
-
-    def libusb(self):
-        self.download_source("http://downloads.sourceforge.net/libusb-win32/"
-            "libusb-win32-src-1.2.6.0.zip", "libusb.zip",
-            "972438b7465a22882bc91a1238291240ee3cdb09f374454a027d003b150656d4"
-            "c262553104f74418bb49b4a7ca2f1a4f72d20e689fa3a7728881bafc876267f4")
-        self.extract_source_zip("libusb.zip")
-
-        with open(self.eloc("libusb.patch")) as p:
-            self.src_cmd("patch", "-p1", stdin=p)
-
-        self.make("host_prefix=i586-mingw32msvc", "dll")
+    def libusb_install(self, recipe):
         os.unlink(self.loc("temp", "src", "libusb.a"))
-        self.src_cmd("i586-mingw32msvc-ar", "rcs", "libusb.a",
+        self.src_cmd(MINGW_NAME + "-ar", "rcs", "libusb.a",
                      *glob.glob(self.loc("temp", "src", "*.2.o")))
-        self.src_cmd("i586-mingw32msvc-ranlib", "libusb.a")
-
-        os.mkdir(self.loc("items", "libusb", "include"))
-        os.mkdir(self.loc("items", "libusb", "lib"))
+        self.src_cmd(MINGW_NAME + "-ranlib", "libusb.a")
 
         shutil.copy(self.loc("temp", "src", "src", "lusb0_usb.h"),
                     self.loc("items", "libusb", "include", "usb.h"))
         shutil.copy(self.loc("temp", "src", "libusb.a"),
                     self.loc("items", "libusb", "lib"))
 
+        pc = self.loc("items", "libusb", "lib", "pkgconfig", "libusb.pc")
         with open(self.eloc("libusb.pc")) as source:
-            with open(self.loc("items", "libusb", "libusb.pc"), "w") as dest:
+            with open(pc, "w") as dest:
                 for line in source:
                     if line == "prefix=\n":
                         line = "prefix={0}\n".format(
                                 self.loc("items", "libusb"))
                     dest.write(line)
 
-        self.rm_f(self.loc("pkgconfig", "libusb.pc"))
-        os.symlink(self.loc("items", "libusb", "libusb.pc"),
-                   self.loc("pkgconfig", "libusb.pc"))
-
-    def hamlib(self):
-        self.download_source("http://downloads.sourceforge.net/hamlib/"
-            "hamlib-1.2.14.tar.gz", "hamlib.tar.gz",
-            "a209048750e7e55a2386af436e01741ffab0338aa21db8d1a82eb0072a5161e2"
-            "9c722c5cc1ea5d021dac9a069f7c4fe3a41c73969a6d39cdee88f809c1ea4354")
-        self.extract_source_tar("hamlib.tar.gz")
-
-        env = os.environ.copy()
-        env["PKG_CONFIG_LIBDIR"] = self.loc("pkgconfig")
-
-        self.configure("--prefix=" + self.loc("items", "hamlib"),
-                "--without-rigmatrix", "--without-rpc-backends",
-                "--without-winradio", "--without-gnuradio", "--without-usrp",
-                "--without-cxx-binding", "--without-perl-binding",
-                "--without-tcl-binding", "--without-python-binding",
-                flag_items=["pthreadsw32", "libtool", "libusb"],
-                env=env,
-                *STD_CONFIGURE)
-
-        # Ugh...
-        self.src_cmd("sed", "-i", "s/ tests doc$/ doc/", "Makefile")
-        self.src_cmd("sed", "-i", "s/^int usleep/\/\//",
-                     "lib/win32termios.h") # int != long
-        os.mkdir(self.loc("temp", "src", "libltdl"))
-        self.make("DEFS=-DHAVE_SLEEP -DHAVE_CONFIG_H")
-        self.make("install")
-
+    def hamlib_fix_pc(self, recipe):
         fn = self.loc("items", "hamlib", "lib", "pkgconfig", "hamlib.pc")
         with open(fn) as f:
             lines = f.readlines()
@@ -671,58 +1360,13 @@ class Builder:
                             self.loc("items", "libusb", "lib"))
                 f.write(line)
 
-        self.copy_pkgconfig("hamlib", "hamlib.pc")
-
-    def openssl(self):
-        self.download_source("http://www.openssl.org/source/"
-            "openssl-1.0.1c.tar.gz", "openssl.tar.gz",
-            "14f766daab0828a2f07c65d6da8469a4a5a2b839ff3da188538c4e2db3e3e2f3"
-            "7217fb37e269617fb438463b75fb77dab0b155f36831ff48edbc9e7f2903ebd3")
-        self.extract_source_tar("openssl.tar.gz")
-
-        self.src_cmd("/bin/bash", "./Configure", "mingw",
-                "--prefix=" + self.loc("items", "openssl"))
-
-        self.make("CC=" + MINGW_NAME + "-gcc",
-                  "AR=" + MINGW_NAME + "-ar r",
-                  "RANLIB=" + MINGW_NAME + "-ranlib",
-                  "DIRS=crypto ssl engines",
-                  "all")
-        self.make("DIRS=crypto ssl engines", "install_sw")
-
-        self.copy_pkgconfig("openssl", "openssl.pc")
-        self.copy_pkgconfig("openssl", "libssl.pc")
-        self.copy_pkgconfig("openssl", "libcrypto.pc")
-
-    def curl(self):
-        self.download_source("http://curl.haxx.se/download/curl-7.27.0.tar.gz",
-            "curl.tar.gz",
-            "d701631e897464d92582a77f13e8aed17f10ee1d284007af3c1435a6c2263c90"
-            "b4ba0334b9b41b20e34518d5d5be7cf0fd7c1ef0092bc592bd137577f5faf213")
-        self.extract_source_tar("curl.tar.gz")
-
-        self.configure("--prefix=" + self.loc("items", "curl"),
-                "--with-zlib=" + self.loc("items", "zlib"),
-                "--with-ssl=" + self.loc("items", "openssl"),
-                "--without-ldap-lib",
-                "--disable-manual", *STD_CONFIGURE)
-        self.make()
-        self.make("install")
-
-        self.copy_pkgconfig("curl", "libcurl.pc")
-        shutil.rmtree(self.loc("items", "curl", "share"))
-
-    def mingw_fakepath(self):
-        for n in ["addr2line", "ar", "as", "c++", "cc", "c++filt", "cpp",
-                  "dlltool", "dllwrap", "g++", "gcc", "gccbug",
-                  "gcov", "gfortran", "gprof", "ld", "nm", "objcopy",
-                  "objdump", "ranlib", "readelf", "size", "strings",
-                  "strip", "windmc", "windres"]:
+    def mingw_fakepath(self, recipe):
+        for n in FAKEPATH_TOOLS:
             target_name = MINGW_NAME + "-" + n
-            os.symlink(self.find_path(target_name),
+            os.symlink(paths.find_path(target_name),
                        self.loc("items", "mingw_fakepath", n))
 
-    def dl_fldigi(self):
+    def dl_fldigi(self, recipe):
         self.src_cmd("git", "clone", self.dl_fldigi_source,
                      self.loc("temp", "src"), cwd=None)
         if self.dl_fldigi_commit:
@@ -730,35 +1374,234 @@ class Builder:
 
         self.src_cmd("git", "submodule", "init")
         self.src_cmd("git", "submodule", "update")
-        self.src_cmd("autoreconf", "-vfi")
+        self.autotools("autoreconf", "-vfi")
+
+        if not self.configs:
+            self.dl_fldigi_config(recipe, {"name": None, "args": [],
+                                           "profile": self.options["profile"]})
+            return
+
+        # One checkout, several out-of-tree (VPATH) builds in parallel
+        threads = []
+        errors = []
+
+        for config in self.configs:
+            def build(config=config):
+                try:
+                    self.dl_fldigi_config(recipe, config)
+                except:
+                    logger.exception("Error building configuration " +
+                                     config["name"])
+                    errors.append(config["name"])
+
+            t = threading.Thread(target=build)
+            t.start()
+            threads.append(t)
+
+        for t in threads:
+            t.join()
+
+        if errors:
+            raise Exception("Configurations failed: " + ", ".join(errors))
+
+    def dl_fldigi_config(self, recipe, config):
+        name = config["name"]
+        src = self.loc("temp", "src")
+        kwargs = {}
+
+        if name:
+            build = self.loc("temp", "build-" + name)
+            os.mkdir(build)
+            log = capture.Capture(self.loc("logs", "dl_fldigi-" + name +
+                                           ".log.gz"),
+                                  self.options["log_lines"],
+                                  self.options["verbose"])
+            kwargs = {"cwd": build, "capture": log}
+            logger.info("Building dl_fldigi configuration " + name)
+        else:
+            build = src
 
         env = os.environ.copy()
+        env.update(self.flags_env(profiles.flags(config["profile"],
+                                  self.options["target_cpu"],
+                                  self.options["lto"],
+                                  gc_sections=self.options["shrink"])))
         env["PKG_CONFIG_LIBDIR"] = self.loc("pkgconfig")
 
-        self.configure("--disable-nls", "--disable-flarq",
-                   "--without-pulseaudio",
-                   "--with-ptw32=" + self.loc("items", "pthreadsw32"),
-                   "FLTK_CONFIG=" + self.loc("items", "fltk", "bin",
-                                             "fltk-config"),
-                   "XMLRPC_C_CONFIG=" + self.loc("items", "xmlrpc", "bin",
-                                                 "xmlrpc-c-config"),
-                   "X_CFLAGS=-DXMD_H", # Inhibit libjpeg crud
-                   "LIBS=-lltdl",
-                   flag_items=["libjpeg", "zlib", "openssl", "libtool"],
-                   env=env,
-                   *STD_CONFIGURE)
-        self.make()
-
-        self.make("hamlib-static", env=env)
-        self.make("nsisinst")
-
-        search = glob.glob(self.loc("temp", "src", "src",
-                                    "dl-fldigi-*_setup.exe"))
+        # The last link, of the hamlib-static binary, is the one shipped
+        link_map = os.path.join(build, "dl-fldigi.map")
+        if self.options["shrink"] or self.options["analyse"] or self.trim:
+            env["LDFLAGS"] = (env.get("LDFLAGS", "") +
+                              " -Wl,-Map," + link_map).strip()
+
+        try:
+            self.configure("--disable-nls", "--disable-flarq",
+                       "--without-pulseaudio",
+                       "--with-ptw32=" + self.loc("items", "pthreadsw32"),
+                       "FLTK_CONFIG=" + self.loc("items", "fltk", "bin",
+                                                 "fltk-config"),
+                       "XMLRPC_C_CONFIG=" + self.loc("items", "xmlrpc",
+                                                     "bin",
+                                                     "xmlrpc-c-config"),
+                       "X_CFLAGS=-DXMD_H", # Inhibit libjpeg crud
+                       "LIBS=-lltdl",
+                       flag_items=["libjpeg", "zlib", "openssl", "libtool"],
+                       env=env, cache="shared",
+                       script=os.path.join(src, "configure"),
+                       *(STD_CONFIGURE + config["args"]), **kwargs)
+            self.make(**kwargs)
+
+            self.make("hamlib-static", env=env, **kwargs)
+
+            if self.options["analyse"] or self.trim:
+                self.check_symbols(build, link_map, **kwargs)
+
+            debug = None
+            if self.options["shrink"]:
+                self.report_sizes(link_map, name or "default")
+                if profiles.strip(config["profile"]):
+                    debug = self.split_debug(build, name or "default",
+                                             **kwargs)
+
+            self.make("nsisinst", **kwargs)
+        finally:
+            if name:
+                log.close()
+
+        search = glob.glob(os.path.join(build, "src",
+                                        "dl-fldigi-*_setup.exe"))
         installer = search[0]
+        name = profiles.artifact_name(os.path.basename(installer),
+                                      name or config["profile"])
+
+        output = self.options["output"]
+        if os.path.isdir(output):
+            output = os.path.join(output, name)
+
+        shutil.copy(installer, output)
+        logger.info("Saved binary " + name + " to " + self.options["output"] +
+                    " ({0} kB)".format(os.path.getsize(installer) // 1024))
+        self.metrics.set("artifact_size_bytes", os.path.getsize(installer),
+                         "Size of each saved installer or package",
+                         artifact="installer", config=config["name"] or
+                         "default", profile=config["profile"])
+
+        if debug:
+            name = os.path.splitext(name)[0] + "-debug.tar.gz"
+            shutil.copy(debug, os.path.join(os.path.dirname(output), name))
+            logger.info("Saved debug info " + name)
+
+    def report_sizes(self, link_map, config):
+        if not os.path.exists(link_map):
+            logger.warning("No link map at " + link_map + "; can't report "
+                           "library sizes")
+            return
 
-        shutil.copy(installer, self.options["output"])
-        logger.info("Saved binary " + os.path.basename(installer) + " to " +
-                    self.options["output"])
+        sizes = linkmap.library_sizes(linkmap.parse(link_map),
+                                      self.loc("items"))
+        if not sizes:
+            logger.warning("Nothing found in " + link_map)
+            return
+        total = sum(sizes.values())
+
+        lines = ["{0:>8} kB {1:5.1f}% {2}".format(size // 1024,
+                                                  100.0 * size / total, lib)
+                 for (size, lib) in sorted(((v, k) for (k, v)
+                                            in sizes.items()), reverse=True)]
+        logger.info("Contributions to dl-fldigi's size:\n" + "\n".join(lines))
+
+        for (lib, size) in sizes.items():
+            self.metrics.set("library_size_bytes", size,
+                             "Bytes each library contributes to dl-fldigi",
+                             library=lib, config=config)
+
+    def find_binaries(self, build):
+        binaries = [fn for fn in glob.glob(os.path.join(build, "src", "*.exe"))
+                    if not fn.endswith("_setup.exe")]
+        if not binaries:
+            raise Exception("No binaries found in " + build)
+        return binaries
+
+    def check_symbols(self, build, link_map, **kwargs):
+        objects = [os.path.join(path, fn) for (path, dirnames, filenames)
+                   in os.walk(os.path.join(build, "src"))
+                   for fn in filenames if fn.endswith(".o")]
+        defined = self.symbols(self.find_binaries(build), "--defined-only",
+                               **kwargs)
+
+        if self.trim:
+            missing = trim.missing_symbols(self.trim, defined)
+            if missing:
+                raise Exception("Trimmed build lacks symbols: " +
+                                " ".join(missing))
+            logger.info("Trimmed build has all {0} symbols dl-fldigi needs"
+                        .format(len(self.trim["symbols"])))
+
+        if self.options["analyse"]:
+            # What dl-fldigi's own objects need, and a library provided
+            wanted = self.symbols(objects, "-u", **kwargs) - \
+                     self.symbols(objects, "--defined-only", **kwargs)
+            profile = trim.analyse(linkmap.parse(link_map), self.loc("items"),
+                                   trim.url_schemes(self.loc("temp", "src")),
+                                   wanted & defined)
+
+            with open(self.options["analyse"], "w") as f:
+                json.dump(profile, f, indent=4, sort_keys=True)
+            logger.info("Wrote trim profile for " +
+                        (", ".join(sorted(profile["items"])) or "no items") +
+                        " to " + self.options["analyse"])
+
+    def symbols(self, paths, *args, **kwargs):
+        if not paths:
+            return set()
+
+        out = self.src_cmd_output(MINGW_NAME + "-nm", *(list(args) + paths),
+                                  **kwargs)
+        names = set()
+        for line in out.splitlines():
+            parts = line.split()
+            if len(parts) >= 2:
+                names.add(parts[-1])
+        return names
+
+    def split_debug(self, build, config, **kwargs):
+        """Move the binaries' debug info to a tarball, which is returned."""
+
+        binaries = self.find_binaries(build)
+
+        def split(binary):
+            # Captures aren't thread safe, so each binary gets its own log
+            fn = "split_debug-{0}-{1}.log.gz".format(
+                    config, os.path.splitext(os.path.basename(binary))[0])
+            log = capture.Capture(self.loc("logs", fn),
+                                  self.options["log_lines"],
+                                  self.options["verbose"])
+            args = dict(kwargs, capture=log)
+            debug = binary + ".debug"
+
+            try:
+                self.src_cmd(MINGW_NAME + "-objcopy", "--only-keep-debug",
+                             binary, debug, **args)
+                self.src_cmd(MINGW_NAME + "-strip", "--strip-all", binary,
+                             **args)
+                self.src_cmd(MINGW_NAME + "-objcopy",
+                             "--add-gnu-debuglink=" + debug, binary, **args)
+            finally:
+                log.close()
+            return debug
+
+        pool = multiprocessing.pool.ThreadPool(len(binaries))
+        try:
+            debug_files = pool.map(split, binaries)
+        finally:
+            pool.close()
+            pool.join()
+
+        archive = os.path.join(build, "debug.tar.gz")
+        with tarfile.open(archive, "w:gz") as t:
+            for fn in debug_files:
+                t.add(fn, os.path.basename(fn))
+        return archive
 
 if __name__ == "__main__":
     Builder().main()
@@ -0,0 +1,32 @@
+# Copyright 2013 (C) Daniel Richman. License: GNU GPL 3
+
+# Shared by debian.py and mingw.py: finding tools and opening the
+# directories they keep between runs.
+
+import os
+import os.path
+import stat
+import errno
+
+def find_path(name):
+    for d in os.environ["PATH"].split(":"):
+        path = os.path.realpath(os.path.join(d, name))
+        if os.path.exists(path):
+            return path
+    raise Exception("Could not find " + name + " in the path")
+
+def open_dir(path):
+    """Create path if it doesn't exist; return True if it was created."""
+
+    try:
+        mode = os.stat(path).st_mode
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+        os.mkdir(path)
+        return True
+    else:
+        if not stat.S_ISDIR(mode):
+            raise Exception(path + " is not a directory")
+        return False
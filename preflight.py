@@ -0,0 +1,60 @@
+# Copyright 2013 (C) Daniel Richman. License: GNU GPL 3
+
+# Shared by debian.py and mingw.py: runs a list of independent checks in
+# parallel before anything is built, so that every missing tool or broken
+# patch is reported at once rather than one per (long) build attempt.
+# A check is a callable returning a list of problems, as strings.
+
+import os
+import logging
+import subprocess
+import multiprocessing.pool
+
+logger = logging.getLogger("builder")
+
+MAX_THREADS = 8
+
+def run(checks):
+    logger.info("Preflight: running {0} checks".format(len(checks)))
+
+    pool = multiprocessing.pool.ThreadPool(min(len(checks), MAX_THREADS))
+    try:
+        results = pool.map(call, checks)
+    finally:
+        pool.close()
+        pool.join()
+
+    problems = [p for r in results for p in r]
+    if problems:
+        raise Exception("Preflight found {0} problem(s):\n  {1}"
+                        .format(len(problems), "\n  ".join(problems)))
+
+def call(check):
+    try:
+        return check()
+    except Exception as e:
+        return [str(e)]
+
+def command_output(args, **kwargs):
+    """Run args, returning (exit status, combined output)."""
+
+    try:
+        p = subprocess.Popen(args, stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT, **kwargs)
+    except OSError as e:
+        return (None, str(e))
+
+    out = p.communicate()[0]
+    return (p.returncode, out.strip())
+
+def check_executable(find_path, name):
+    if os.path.isabs(name):
+        if not os.access(name, os.X_OK):
+            return [name + " is not executable"]
+        return []
+
+    try:
+        find_path(name)
+    except Exception as e:
+        return [str(e)]
+    return []
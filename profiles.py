@@ -0,0 +1,75 @@
+# Copyright 2013 (C) Daniel Richman. License: GNU GPL 3
+
+# Named optimisation profiles, shared by debian.py and mingw.py. "default"
+# leaves every package with the flags it chooses itself, as before.
+#
+#   cflags      used for both CFLAGS and CXXFLAGS
+#   ldflags     LDFLAGS
+#   march       baseline CPU for the Windows build (-march/-mtune); debian
+#               builds target whatever the distribution does unless
+#               --target-cpu is given
+#   strip       False to keep debug info in the shipped binaries
+
+import os
+
+PROFILES = {
+    "default": {},
+    "release-speed": {
+        "cflags": ["-O2", "-ftree-vectorize", "-fomit-frame-pointer"],
+        "march": "i686",
+    },
+    "release-size": {
+        "cflags": ["-Os"],
+        "march": "i686",
+    },
+    "debug": {
+        "cflags": ["-O0", "-g"],
+        "strip": False,
+    },
+}
+
+def names():
+    return sorted(PROFILES)
+
+def flags(name, target_cpu=None, lto=False, cross=True, gc_sections=False,
+          append=False):
+    """Return a dict of CFLAGS, CXXFLAGS and LDFLAGS lists for a profile.
+
+    Unless append is set (the flags are added to defaults elsewhere, as
+    dpkg-buildflags does), a profile without cflags of its own gets
+    autoconf's default -g -O2 as soon as any flag is added: setting CFLAGS
+    at all would lose it, and build everything at -O0.
+    """
+
+    profile = PROFILES[name]
+    cflags = list(profile.get("cflags", []))
+    ldflags = list(profile.get("ldflags", []))
+
+    if gc_sections:
+        cflags += ["-ffunction-sections", "-fdata-sections"]
+        ldflags.append("-Wl,--gc-sections")
+
+    cpu = target_cpu or (cross and profile.get("march"))
+    if cpu:
+        cflags += ["-march=" + cpu, "-mtune=generic"]
+
+    if lto:
+        cflags.append("-flto")
+        ldflags.append("-flto")
+
+    if cflags and not profile.get("cflags") and not append:
+        cflags = ["-g", "-O2"] + cflags
+
+    return {"CFLAGS": cflags, "CXXFLAGS": list(cflags), "LDFLAGS": ldflags}
+
+def strip(name):
+    return PROFILES[name].get("strip", True)
+
+def artifact_name(filename, name):
+    """Insert the profile name before filename's extension."""
+
+    if name == "default":
+        return filename
+
+    (base, ext) = os.path.splitext(filename)
+    return base + "-" + name + ext
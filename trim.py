@@ -0,0 +1,120 @@
+# Copyright 2013 (C) Daniel Richman. License: GNU GPL 3
+
+# mingw.py's --analyse and --trim-profile. Analysis looks at a full build
+# of dl-fldigi: the link map says which objects of each library were
+# linked in, nm which symbols dl-fldigi needs from them, and the source
+# which URL schemes it uses. From that it writes a trim profile, a JSON
+# file of extra arguments for the dependencies' builds:
+#
+#   {"items": {"curl": {"configure": ["--disable-ftp", ...]},
+#              "openssl": {"make": {"DIRS": "crypto ssl"}}},
+#    "symbols": [...], "libraries": {...}, "schemes": [...],
+#    "notes": {...}}
+#
+# "configure" arguments are appended to the item's, and "make" replaces
+# VAR=value arguments of its make invocations. A build with the profile
+# checks that every one of "symbols" is still defined in dl-fldigi.
+
+import os
+import os.path
+import re
+import copy
+import logging
+import collections
+
+import linkmap
+
+logger = logging.getLogger("builder")
+
+# curl's --disable-X options, and the URL schemes that need each
+CURL_PROTOCOLS = [
+    ("http", ["http", "https"]),
+    ("ftp", ["ftp", "ftps"]),
+    ("file", ["file"]),
+    ("rtsp", ["rtsp"]),
+    ("dict", ["dict"]),
+    ("telnet", ["telnet"]),
+    ("tftp", ["tftp"]),
+    ("pop3", ["pop3", "pop3s"]),
+    ("imap", ["imap", "imaps"]),
+    ("smtp", ["smtp", "smtps"]),
+    ("gopher", ["gopher"]),
+]
+
+# The objects openssl's engines/ directory adds to libcrypto.a when it is
+# in DIRS. crypto/evp's ciphers (e_aes.o etc.) share the e_ prefix, so the
+# names are listed in full.
+OPENSSL_ENGINE = re.compile(r"^(e_(4758cca|aep|atalla|capi|chil|cswift|gmp|"
+                            r"nuron|padlock|sureware|ubsec|gost_err)|"
+                            r"gost.*)\.o$")
+OPENSSL_DIRS = ["crypto", "ssl", "engines"]
+
+SOURCE_EXTENSIONS = (".c", ".cxx", ".cpp", ".cc", ".h", ".hxx", ".fl")
+SCHEME = re.compile(r"\b([a-z][a-z0-9]*)://")
+
+NOTES = {
+    "hamlib": "not trimmed: rig backends are chosen at run time, so no "
+              "link can show which are used",
+}
+
+def url_schemes(srcdir):
+    schemes = set()
+    for (path, dirnames, filenames) in os.walk(srcdir):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+        for fn in filenames:
+            if fn.endswith(SOURCE_EXTENSIONS):
+                with open(os.path.join(path, fn)) as f:
+                    schemes.update(SCHEME.findall(f.read()))
+    return schemes
+
+def analyse(entries, items_dir, schemes, symbols):
+    """Build a trim profile from a link map's entries, the URL schemes
+    found in the source and the symbols dl-fldigi takes from libraries.
+    """
+
+    libraries = collections.defaultdict(set)
+    for (section, size, archive, member) in entries:
+        if archive:
+            libraries[linkmap.library_name(archive, items_dir)].add(member)
+
+    items = {}
+
+    disable = ["--disable-" + option for (option, needs) in CURL_PROTOCOLS
+               if not schemes.intersection(needs)]
+    if disable:
+        items["curl"] = {"configure": disable}
+
+    if not any(OPENSSL_ENGINE.match(m) for m in libraries.get("openssl", [])):
+        dirs = [d for d in OPENSSL_DIRS if d != "engines"]
+        items["openssl"] = {"make": {"DIRS": " ".join(dirs)}}
+
+    return {"items": items, "symbols": sorted(symbols),
+            "libraries": dict((k, sorted(v)) for (k, v) in libraries.items()),
+            "schemes": sorted(schemes), "notes": NOTES}
+
+def apply(recipes, profile):
+    """Return a copy of recipes with the profile's arguments added."""
+
+    recipes = copy.deepcopy(recipes)
+    by_name = dict((r["name"], r) for r in recipes)
+
+    for (name, changes) in profile["items"].items():
+        if name not in by_name:
+            logger.warning("Trim profile names unknown item " + name)
+            continue
+        recipe = by_name[name]
+
+        if "configure" in changes:
+            recipe["configure"] = recipe.get("configure", []) + \
+                                  changes["configure"]
+
+        for (var, value) in changes.get("make", {}).items():
+            for args in recipe.get("make", []):
+                for (i, arg) in enumerate(args):
+                    if arg.startswith(var + "="):
+                        args[i] = var + "=" + value
+
+    return recipes
+
+def missing_symbols(profile, defined):
+    return sorted(set(profile["symbols"]) - set(defined))
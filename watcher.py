@@ -0,0 +1,152 @@
+# Copyright 2013 (C) Daniel Richman. License: GNU GPL 3
+
+# Shared by debian.py and mingw.py's --watch mode: keeps a mirror of the
+# dl-fldigi repository up to date and calls a build function for each new
+# commit on the watched ref. Commits that arrive while a build is running,
+# or within the settle time of each other, are coalesced so that only the
+# newest is built.
+
+import os
+import os.path
+import json
+import time
+import errno
+import logging
+import subprocess
+
+logger = logging.getLogger("builder")
+
+HISTORY_LENGTH = 20
+
+class Watcher:
+    def __init__(self, source, ref, mirror, status_file,
+                 interval=60, settle=30):
+        self.source = source
+        self.ref = ref or "HEAD"
+        self.mirror = mirror
+        self.status_file = status_file
+        self.interval = interval
+        self.settle = settle
+
+        self.queue = []
+        self.last_change = None
+        self.mirror_hits = 0
+        self.mirror_misses = 0
+        self.status = {"source": source, "ref": self.ref, "mirror": mirror,
+                       "state": "starting", "current": None, "queue": [],
+                       "last_built": None, "history": []}
+
+    def git(self, *args, **kwargs):
+        logger.debug("Executing: git " + repr(args))
+        with open("/dev/null", "w") as null:
+            p = subprocess.Popen(("git", ) + args, stdout=subprocess.PIPE,
+                                 stderr=null, **kwargs)
+            out = p.communicate()[0]
+        if p.returncode != 0:
+            raise Exception("git error exited " + repr(args))
+        return out.strip()
+
+    def open(self):
+        try:
+            with open(self.status_file) as f:
+                old = json.load(f)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        else:
+            self.status["last_built"] = old.get("last_built")
+            self.status["history"] = old.get("history", [])
+
+        if os.path.exists(self.mirror):
+            logger.info("Using mirror " + self.mirror)
+            self.mirror_hits += 1
+        else:
+            logger.info("Mirroring " + self.source + " to " + self.mirror)
+            self.git("clone", "--mirror", self.source, self.mirror)
+            self.mirror_misses += 1
+
+    def poll(self):
+        self.git("fetch", "--prune", cwd=self.mirror)
+        return self.git("rev-parse", self.ref + "^{commit}", cwd=self.mirror)
+
+    def write_status(self, state):
+        self.status["state"] = state
+        self.status["queue"] = list(self.queue)
+        self.status["updated"] = time.time()
+
+        tmp = self.status_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.status, f, indent=4)
+        os.rename(tmp, self.status_file)
+
+    def run(self, build):
+        """Poll forever, calling build(commit) -> bool for new commits."""
+
+        self.open()
+
+        try:
+            while True:
+                self.check()
+
+                if self.queue and \
+                        time.time() - self.last_change >= self.settle:
+                    self.build_newest(build)
+                else:
+                    self.write_status("waiting" if self.queue else "idle")
+                    time.sleep(self.interval if not self.queue
+                               else min(self.interval, self.settle))
+        except KeyboardInterrupt:
+            logger.info("Stopping")
+        finally:
+            self.write_status("stopped")
+
+    def check(self):
+        try:
+            commit = self.poll()
+        except:
+            logger.exception("Error whilst polling " + self.source)
+            return
+
+        if self.queue and commit == self.queue[-1]:
+            return
+        if not self.queue and commit == self.status["last_built"]:
+            return
+
+        if commit in self.queue:
+            # The branch moved back (a force push): build the tip, not
+            # the commit queued after it
+            logger.info("Back to commit " + commit)
+            self.queue.remove(commit)
+        else:
+            logger.info("New commit " + commit)
+        self.queue.append(commit)
+        self.last_change = time.time()
+
+    def build_newest(self, build):
+        commit = self.queue.pop()
+        superseded = self.queue
+        self.queue = []
+
+        if superseded:
+            logger.info("Skipping superseded commits " + " ".join(superseded))
+
+        self.status["current"] = commit
+        self.write_status("building")
+
+        started = time.time()
+        try:
+            ok = build(commit)
+        except KeyboardInterrupt:
+            raise
+        except:
+            logger.exception("Error in build")
+            ok = False
+
+        self.status["current"] = None
+        self.status["last_built"] = commit
+        self.status["history"].insert(0, {
+            "commit": commit, "success": ok, "superseded": superseded,
+            "started": started, "finished": time.time()})
+        del self.status["history"][HISTORY_LENGTH:]
+
+        logger.info("Build of " + commit + (" succeeded" if ok else " failed"))